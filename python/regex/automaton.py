@@ -1,5 +1,19 @@
+from array import array
+
+from charclass import alphabet_for, anchors
+
+class StateLimitError(Exception):
+    """Raised when building a DFA with more states than allowed"""
+    pass
+
 class State(object):
-    """A state in the automaton"""
+    """A state in the automaton
+
+        States are made by the thousand, so they have __slots__ rather than a
+        __dict__
+    """
+    __slots__ = ("start", "accept", "transitions")
+
     def __init__(self, start=False, accept=False):
         self.start = start
         self.accept = accept
@@ -27,27 +41,37 @@ class State(object):
     def set_accept(self, accept):
         self.accept = bool(accept)
 
-    def clone(self):
-        s = type(self)(self.is_start(), self.is_accept())
-        self._clone = s
-        for t,v in self.transitions.items():
-            # this to stop back edges creating infinite recursion
-            nxt = v._clone if hasattr(v,"_clone") else v.clone()
-            s.add_transition(nxt,t)
-        del self._clone
-        return s
+    def clone(self, mapping=None):
+        """ Returns a copy of this state and of every state reachable from it
+
+            If a dict is passed as mapping it is filled with the copy of each
+            of the cloned states
+        """
+        copies = {} if mapping is None else mapping
+        copies[self] = type(self)(self.is_start(), self.is_accept())
+        stack = [self]
+        while stack:
+            v = stack.pop()
+            for t,u in v.adj():
+                if u not in copies:
+                    copies[u] = type(u)(u.is_start(), u.is_accept())
+                    stack.append(u)
+                copies[v].add_transition(copies[u], t)
+        return copies[self]
 
     def __str__(self):
         def vid(v):
             return str(id(v))[-3:]
         format_str = "%s (start: %s, accept: %s): t[%s]"
 
-        trans = ["%s->%s"%(t,vid(n)) for t,n in self.transitions.iteritems()]
+        trans = ["%s->%s"%(t,vid(n)) for t,n in self.transitions.items()]
         return format_str % (vid(self),self.is_start(),self.is_accept(),
                 ",".join(trans))
 
 class NFAState(State):
     """Represents a state in a NFA"""
+    __slots__ = ("null_transitions",)
+
     def __init__(self, start=False, accept=False):
         super(NFAState, self).__init__(start,accept)
         self.null_transitions = []
@@ -67,12 +91,6 @@ class NFAState(State):
     def get_null_transitions(self):
         return self.null_transitions
 
-    def clone(self):
-        s = super(NFAState,self).clone()
-        for v in self.get_null_transitions():
-            s.add_transition(v.clone())
-        return s
-
     def __str__(self):
         def vid(v):
             return str(id(v))[-3:]
@@ -81,15 +99,29 @@ class NFAState(State):
         return "%s %s" % (super(NFAState,self).__str__(), null_trans)
 
 class DFAState(State):
-    """Represents a state in a DFA"""
+    """Represents a state in a DFA
+
+        A state is an eoi (end of input) accept state when it accepts once the
+        input is exhausted, including through a $ anchor
+    """
+    __slots__ = ("substates", "eoi_accept")
+
     def __init__(self, start=False, accept=False, substates=None):
         super(DFAState, self).__init__(start,accept)
-        self.substates = set(substates) if substates else set()
+        # shared with the index of the DFA, so it is kept only once
+        self.substates = frozenset(substates) if substates else frozenset()
+        self.eoi_accept = accept
 
     def get_substates(self):
         """ returns the set of DFASubstates represented by this DFAstate """
         return self.substates
 
+    def is_eoi_accept(self):
+        return self.eoi_accept
+
+    def set_eoi_accept(self, accept):
+        self.eoi_accept = bool(accept)
+
 class Automaton(object):
     """ Represents and Automaton"""
     def __init__(self, start_state):
@@ -114,30 +146,37 @@ class Automaton(object):
         self._dfs(lambda v: states.append(v))
         return states
 
-    def clone(self):
-        """ returns another NFA that is a copy of this one """
-        start = self.get_start_state().clone()
+    def clone(self, mapping=None):
+        """ returns another NFA that is a copy of this one
+
+            see State.clone for mapping
+        """
+        start = self.get_start_state().clone(mapping)
         return type(self)(start)
 
+    def get_entry_states(self):
+        """Returns the states traversals start from"""
+        return [self.start]
+
     def _dfs(self, op):
         # Preforms depth-first search on Automaton 
         # executes function 'op' on each of the visited states
-        def dfs_recur(v):
-            op(v)
-            v._visited = True
-            for trans,u in v.adj():       
-                assert u
-                if not hasattr(u, "_visited"):
-                    dfs_recur(u)
-
-        def reset_visited(v):
-            delattr(v, "_visited")
-            for trans,u in v.adj():
-                if hasattr(u,"_visited"):
-                    reset_visited(u)
-
-        dfs_recur(self.start)
-        reset_visited(self.start)
+        # The states are not modified, so several threads can walk the same
+        # Automaton at once
+        visited = set()
+        for root in self.get_entry_states():
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [root]
+            while stack:
+                v = stack.pop()
+                op(v)
+                for trans,u in reversed(list(v.adj())):
+                    assert u
+                    if u not in visited:
+                        visited.add(u)
+                        stack.append(u)
 
     def __str__(self):
         out = []
@@ -150,35 +189,138 @@ class Automaton(object):
         return "\n".join(out)
 
 class NFA(Automaton):
-    """Non-deterministic finite automaton"""
+    """Non-deterministic finite automaton
+
+        The methods below, and the matchers built from an NFA, only look at
+        its states through accepts, labelled_transitions, null_targets and
+        target, so a CompactNFA can keep its states as integers
+    """
     def __init__(self, start_state):
         super(NFA,self).__init__(start_state)
 
-    def null_closure(self, states):
-        """returns the null-closure of a set of state in the NFA"""
-        # returns the null-closure of a single state
-        def null_closure_single(state):
-            nc = set()
-            def null_closure_recur(v):
-                nc.add(v)
-                for u in v.get_null_transitions():
-                    null_closure_recur(u)
-            null_closure_recur(state)
-            return nc
+    def accepts(self, s):
+        """returns true if s is an accept state"""
+        return s.is_accept()
+
+    def labelled_transitions(self, s):
+        """returns the (label, next state) pairs of the transitions of s that
+        aren't null transitions"""
+        return s.transitions.items()
+
+    def null_targets(self, s):
+        """returns the states s has a null transition to"""
+        return s.get_null_transitions()
+
+    def target(self, s, trans):
+        """returns the state s goes to on transition trans, or None"""
+        return s.get_transition(trans)
 
+    def compact(self):
+        """returns a CompactNFA with the same states and transitions"""
+        return CompactNFA.from_nfa(self)
+
+    def reverse(self):
+        """ returns an NFA that accepts the reverse of every string this one
+            accepts
+
+            Every transition is turned around and ^ and $ swap places. The
+            new start state has a null transition to each accept state, and
+            the old start state is the only accept state.
+        """
+        swap = {"^": "$", "$": "^"}
+        states = self.get_states()
+        copies = dict((s, NFAState()) for s in states)
+        start = NFAState(start=True)
+        for s in states:
+            v = copies[s]
+            if self.accepts(s):
+                start.add_transition(v)
+            for trans, u in self.labelled_transitions(s):
+                trans = swap.get(trans, trans)
+                w = copies[u]
+                if w.get_transition(trans) is not None:
+                    # a state has one transition per label, so a second one
+                    # goes through a state of its own
+                    mid = NFAState()
+                    w.add_transition(mid)
+                    w = mid
+                w.add_transition(v, trans)
+            for u in self.null_targets(s):
+                copies[u].add_transition(v)
+        copies[self.get_start_state()].set_accept(True)
+        return NFA(start)
+
+    def null_closure(self, states, assertions=(), cache=None):
+        """returns the null-closure of a set of state in the NFA
+
+            assertions are the anchors (^ or $) that hold at the current
+            position; their transitions are followed like null transitions
+
+            cache is an optional dict that keeps the closure of each single
+            state, so it is only computed once when it is passed to every call
+            (e.g. during determinization)
+        """
+        assertions = tuple(assertions)
         nc = set()
         for s in states:
-            nc |= null_closure_single(s)
+            if cache is None:
+                nc |= self._null_closure_single(s, assertions)
+                continue
+            key = (s, assertions)
+            closure = cache.get(key)
+            if closure is None:
+                closure = self._null_closure_single(s, assertions)
+                cache[key] = closure
+            nc |= closure
         return nc
 
+    def _null_closure_single(self, state, assertions):
+        # iterative, so epsilon cycles and long epsilon chains are fine
+        nc = {state}
+        stack = [state]
+        while stack:
+            v = stack.pop()
+            nxt = list(self.null_targets(v))
+            for a in assertions:
+                u = self.target(v, a)
+                if u is not None:
+                    nxt.append(u)
+            for u in nxt:
+                if u not in nc:
+                    nc.add(u)
+                    stack.append(u)
+        return frozenset(nc)
+
+    def live_states(self):
+        """ returns the set of states from which an accept state can be
+            reached; the other states can never lead to a match
+        """
+        states = self.get_states()
+        preds = dict((s, []) for s in states)
+        for s in states:
+            for trans, u in self.labelled_transitions(s):
+                preds[u].append(s)
+            for u in self.null_targets(s):
+                preds[u].append(s)
+
+        live = set(s for s in states if self.accepts(s))
+        stack = list(live)
+        while stack:
+            v = stack.pop()
+            for u in preds[v]:
+                if u not in live:
+                    live.add(u)
+                    stack.append(u)
+        return live
+
     def transition(self, states, trans):
         """ Given a set of states S and a transition t in the NFA returns a
             set of next states that would be reached from S via transition t 
         """
         next_states = set()
         for s in states:
-            nxt = s.get_transition(trans)
-            if nxt:
+            nxt = self.target(s, trans)
+            if nxt is not None:
                 next_states.add(nxt)
         return next_states
 
@@ -187,49 +329,248 @@ class NFA(Automaton):
         given set of NFAStates"""
         vals = set()
         for s in states:
-            vals |= s.get_transition_values()
+            vals.update(t for t,u in self.labelled_transitions(s))
         return vals
 
-    def to_dfa(self):
-        """converts this NFA to a DFA and returns it"""
-        #TODO: get test_NFA_to_DFA to pass
+    def class_transitions(self, states, alphabet):
+        """ Given a set of states S returns a dict mapping the label of each
+            character class to the set of next states reached from S by the
+            characters of that class
+        """
+        moves = {}
+        for s in states:
+            for trans, nxt in self.labelled_transitions(s):
+                if trans in anchors:
+                    continue
+                for cid in alphabet.label_classes(trans):
+                    label = alphabet.class_labels[cid]
+                    moves.setdefault(label, set()).add(nxt)
+        return moves
+
+    def to_dfa(self, unanchored=False, max_states=None):
+        """converts this NFA to a DFA and returns it
+
+            The alphabet is first partitioned into disjoint character classes
+            so that overlapping labels (a, [a-z], \\w, .) become one DFA
+            transition per class
+
+            Anchors are not transitions of the DFA: ^ is followed when
+            building the start state and $ decides which states are eoi
+            accept states. An unanchored DFA has an implicit self-looping
+            prefix, i.e. it accepts wherever a match ends, however far into
+            the input the match started
+        """
+        labels = self.transition_values(self.get_states())
+        alphabet = alphabet_for(labels)
+
+        # a DFA state's transitions and acceptance only depend on the NFA
+        # states that have a labelled transition or accept, so the others are
+        # left out of its substates
+        important = frozenset(s for s in self.get_states()
+                if self.accepts(s) or self.labelled_transitions(s))
+        closures = {}
+        def null_closure(states, assertions=()):
+            return self.null_closure(states, assertions, closures) & important
+
         # get start state
-        start_substates = self.null_closure({self.get_start_state()})
+        start = self.get_start_state()
+        start_substates = null_closure({start}, "^")
         dfa_start = DFAState(start=True, accept=False, substates=start_substates)
 
         # create dfa with start state
-        dfa = DFA(dfa_start)
+        dfa = DFA(dfa_start, alphabet)
+        counters = dfa.counters
         unmarked = [dfa_start]
 
+        def get_or_add_state(substates):
+            counters["state_lookups"] += 1
+            state = dfa.get_state_by_substate(substates)
+            if not state:
+                if max_states is not None and len(dfa) >= max_states:
+                    raise StateLimitError("DFA has over %d states" % max_states)
+                state = DFAState(substates=substates)
+                dfa.add_state(state)
+                unmarked.append(state)
+            return state
+
+        # away from the beginning of the input ^ can't match
+        inner_substates = null_closure({start})
+        dfa.inner_start = get_or_add_state(inner_substates)
+        restart = inner_substates if unanchored else set()
+
         #add transitions to DFA
         while unmarked:
             curr_dfa_state = unmarked.pop()
             curr_nfa_substates = curr_dfa_state.get_substates()
-            for trans in self.transition_values(curr_nfa_substates):
-                trans_nfa_substates = self.null_closure(
-                    self.transition(curr_nfa_substates, trans))
-                trans_dfa_state = dfa.get_state_by_substate(trans_nfa_substates)
-                if not trans_dfa_state:
-                    trans_dfa_state = DFAState(substates=trans_nfa_substates)
-                    unmarked.append(trans_dfa_state)
+            moves = self.class_transitions(curr_nfa_substates, alphabet)
+            for trans in alphabet.class_labels:
+                nxt = moves.get(trans)
+                if not nxt and not unanchored:
+                    continue
+                trans_nfa_substates = null_closure(nxt or ()) | restart
+                trans_dfa_state = get_or_add_state(trans_nfa_substates)
                 curr_dfa_state.add_transition(trans_dfa_state, trans)
+                counters["dfa_transitions"] += 1
 
         # set accept states in dfa
-        for s in dfa.get_states():
-            for sub in s.get_substates():
-                if sub.is_accept():
-                    s.set_accept(True)
-                    continue
+        for s in dfa.states():
+            substates = s.get_substates()
+            s.set_accept(any(self.accepts(sub) for sub in substates))
+            s.set_eoi_accept(any(self.accepts(sub)
+                    for sub in null_closure(substates, "$")))
+        counters["dfa_states"] = len(dfa)
+        counters["closures"] = len(closures)
         return dfa
 
 
+class CompactNFA(NFA):
+    """ An NFA stored in parallel integer arrays instead of State objects
+
+        The states are the integers 0..n-1 and 0 is the start state. The
+        transitions of state s are at indices i from edge_offsets[s] up to
+        edge_offsets[s+1]: the one on labels[edge_labels[i]] goes to
+        edge_targets[i]. Its null transitions go to null_edge_targets[j] for
+        j from null_offsets[s] up to null_offsets[s+1]. accept[s] is 1 if s
+        is an accept state.
+
+        It takes a few bytes per transition where State objects take
+        hundreds per state, and DFA substates are sets of small integers. It
+        can't be modified.
+    """
+    def __init__(self, labels, edge_offsets, edge_labels, edge_targets,
+            null_offsets, null_edge_targets, accept):
+        super(CompactNFA,self).__init__(0)
+        self.labels = labels
+        self.edge_offsets = edge_offsets
+        self.edge_labels = edge_labels
+        self.edge_targets = edge_targets
+        self.null_offsets = null_offsets
+        self.null_edge_targets = null_edge_targets
+        self.accept = accept
+
+    @classmethod
+    def from_nfa(cls, nfa):
+        """ Numbers the states of nfa and copies its transitions to arrays """
+        states = nfa.get_states() # the start state comes first
+        ids = dict((s, i) for i,s in enumerate(states))
+        labels = []
+        label_ids = {}
+        edge_offsets = array("i", [0])
+        edge_labels = array("i")
+        edge_targets = array("i")
+        null_offsets = array("i", [0])
+        null_edge_targets = array("i")
+        accept = bytearray(len(states))
+        for s in states:
+            for trans, u in nfa.labelled_transitions(s):
+                if trans not in label_ids:
+                    label_ids[trans] = len(labels)
+                    labels.append(trans)
+                edge_labels.append(label_ids[trans])
+                edge_targets.append(ids[u])
+            edge_offsets.append(len(edge_targets))
+            for u in nfa.null_targets(s):
+                null_edge_targets.append(ids[u])
+            null_offsets.append(len(null_edge_targets))
+            accept[ids[s]] = nfa.accepts(s)
+        return cls(labels, edge_offsets, edge_labels, edge_targets,
+                null_offsets, null_edge_targets, accept)
+
+    def __len__(self):
+        return len(self.accept)
+
+    def get_accept_states(self):
+        return [s for s in range(len(self)) if self.accept[s]]
+
+    def _dfs(self, op):
+        # every state is reachable from the start state, so they are
+        # visited in order
+        for s in range(len(self)):
+            op(s)
+
+    def accepts(self, s):
+        return bool(self.accept[s])
+
+    def labelled_transitions(self, s):
+        begin, end = self.edge_offsets[s], self.edge_offsets[s+1]
+        if begin == end:
+            return []
+        labels = self.labels
+        edge_labels = self.edge_labels
+        edge_targets = self.edge_targets
+        return [(labels[edge_labels[i]], edge_targets[i])
+                for i in range(begin, end)]
+
+    def null_targets(self, s):
+        return self.null_edge_targets[
+                self.null_offsets[s]:self.null_offsets[s+1]]
+
+    def target(self, s, trans):
+        for i in range(self.edge_offsets[s], self.edge_offsets[s+1]):
+            if self.labels[self.edge_labels[i]] == trans:
+                return self.edge_targets[i]
+        return None
+
+    def compact(self):
+        return self
+
+    def clone(self, mapping=None):
+        raise TypeError("a CompactNFA can't be modified, so it isn't cloned")
+
 class DFA(Automaton):
-    def __init__(self, start_state):
+    """Deterministic finite automaton
+
+        alphabet is the partition of the characters the transitions are
+        labelled with; see charclass.Alphabet
+
+        States are indexed by their set of NFA substates. The start states
+        are indexed when the DFA is created; other states have to be
+        registered with add_state to be found by get_state_by_substate.
+        Once the DFA is built drop_substates frees the substates and the
+        index, which are only needed while building it.
+
+        counters records the work done by NFA.to_dfa
+    """
+    def __init__(self, start_state, alphabet=None):
         super(DFA,self).__init__(start_state)
+        self.alphabet = alphabet
+        self._index = {}
+        self._states = []
+        self.add_state(start_state)
+        # the start state for matches that don't begin the input
+        self.inner_start = start_state
+        self.counters = {
+            "dfa_states": 0,
+            "dfa_transitions": 0,
+            "state_lookups": 0,
+            "closures": 0,
+        }
+
+    def get_entry_states(self):
+        if self.inner_start is self.start:
+            return [self.start]
+        return [self.start, self.inner_start]
+
+    def add_state(self, state):
+        """ Registers a state so it can be found by its substates """
+        self._index[frozenset(state.get_substates())] = state
+        self._states.append(state)
+
+    def states(self):
+        """ returns the registered states """
+        return self._states
+
+    def drop_substates(self):
+        """ Frees the NFA substates of every state; they can no longer be
+            found by get_state_by_substate
+        """
+        self._index = {}
+        for s in self._states:
+            s.substates = frozenset()
 
     def get_state_by_substate(self, nfa_substates):
         """ returns the state that has the given NFA substate """
-        for s in self.get_states():
-            if s.get_substates() == nfa_substates:
-                return s
-        return None
+        return self._index.get(frozenset(nfa_substates))
+
+    def __len__(self):
+        return len(self._states)
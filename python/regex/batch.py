@@ -0,0 +1,155 @@
+# batch.py
+# Matching one Pattern against many short inputs, e.g. a column of usernames
+#
+# Calling Pattern.match for every record pays for a method call, the stats
+# and setting up the table walk each time. Here the table is set up once and
+# the records are walked in one loop. A NumPy array of fixed width strings or
+# bytes is walked a column at a time instead: one step moves every record
+# that is still running to its next state with a single vectorized gather.
+#
+# search_many looks for the literal of the Pattern's prefilter first, like
+# Pattern.search does, so the records without it are never walked.
+
+from charclass import suffix
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # only needed to walk NumPy arrays
+
+def match_many(table, inputs):
+    """ Returns a mask of the inputs that table.match accepts
+
+        inputs is a sequence of strings (or of bytes-like objects), or a
+        NumPy array of them. The mask is a list of bools, or for a NumPy array
+        a bool array of the same shape.
+    """
+    if numpy is not None and isinstance(inputs, numpy.ndarray):
+        if inputs.dtype.kind in "SU" and table.engine == "dfa":
+            flat = numpy.ascontiguousarray(inputs).reshape(-1)
+            return _match_array(table, flat).reshape(inputs.shape)
+        mask = match_many(table, inputs.reshape(-1).tolist())
+        return numpy.array(mask, dtype=bool).reshape(inputs.shape)
+    if table.engine != "dfa":
+        return [table.match(inp) for inp in inputs]
+    return _match_list(table, inputs)
+
+def search_many(table, inputs, literal_for=None, prefix=False):
+    """ Returns a mask of the inputs that have a substring the unanchored
+        table accepts, like match_many
+
+        literal_for(inp) returns a literal every match in inp contains, or
+        None if there is nothing to look for (see Pattern._literal); the
+        inputs without it are rejected without walking the table. With
+        prefix every match starts with the literal, so the walk starts where
+        it is first found.
+    """
+    if literal_for is None:
+        return match_many(table, inputs)
+    if numpy is not None and isinstance(inputs, numpy.ndarray):
+        literal = literal_for(inputs.dtype.type())
+        if inputs.dtype.kind not in "SU" or literal is None:
+            mask = search_many(table, inputs.reshape(-1).tolist(),
+                    literal_for, prefix)
+            return numpy.array(mask, dtype=bool).reshape(inputs.shape)
+        # only the rows that have the literal are walked
+        flat = numpy.ascontiguousarray(inputs).reshape(-1)
+        rows = numpy.flatnonzero(numpy.char.find(flat, literal) >= 0)
+        mask = numpy.zeros(len(flat), dtype=bool)
+        if len(rows):
+            mask[rows] = match_many(table, flat[rows])
+        return mask.reshape(inputs.shape)
+    if table.engine != "dfa":
+        mask = []
+        for inp in inputs:
+            pos = _search_start(inp, literal_for, prefix)
+            mask.append(pos != -1 and table.find_end(inp, pos) != -1)
+        return mask
+    return _match_list(table, inputs, literal_for, prefix)
+
+def _search_start(inp, literal_for, prefix):
+    # the index the walk over inp starts from, or -1 if it can't match
+    literal = literal_for(inp)
+    if literal is None:
+        return 0
+    i = inp.find(literal)
+    return i if i == -1 or prefix else 0
+
+def _match_list(table, inputs, literal_for=None, prefix=False):
+    # DFATable.match on each input, with the table set up once; with
+    # literal_for the inputs are prefiltered like in search_many
+    trans = table.trans
+    accept = table.accept
+    eoi_accept = table.eoi_accept
+    k = table.nclasses
+    start = table.start
+    inner_start = table.inner_start
+    classmap_for = table.alphabet.classmap_for
+
+    mask = []
+    for inp in inputs:
+        s = start
+        if literal_for is not None:
+            pos = _search_start(inp, literal_for, prefix)
+            if pos == -1:
+                mask.append(False)
+                continue
+            if pos:
+                inp = suffix(inp, pos)
+                s = inner_start
+        classmap = classmap_for(inp)
+        if not accept[s]:
+            for c in inp:
+                s = trans[s*k + classmap[c]]
+                if accept[s] or not s:
+                    break
+            else:
+                mask.append(bool(eoi_accept[s]))
+                continue
+        mask.append(bool(accept[s]))
+    return mask
+
+def _match_array(table, inputs):
+    # walks a 1-d array of fixed width strings or bytes, one character
+    # position of every input per step
+    n = len(inputs)
+    if inputs.dtype.kind == "S":
+        width = inputs.dtype.itemsize
+        codes = inputs.view(numpy.uint8).reshape(n, width)
+        classmap = table.alphabet.classmap
+        byte_classes = numpy.array([classmap[b] for b in range(256)],
+                dtype=numpy.intp)
+        def classify(c):
+            return byte_classes[c]
+    else:
+        # UCS-4
+        width = inputs.dtype.itemsize // 4
+        codes = inputs.view(numpy.uint32).reshape(n, width)
+        classmap = table.alphabet.classmap
+        bounds = numpy.array(classmap.bounds, dtype=numpy.int64)
+        ids = numpy.array(classmap.ids, dtype=numpy.intp)
+        def classify(c):
+            return ids[numpy.searchsorted(bounds, c, side="right") - 1]
+    # NumPy strings end at the first trailing NUL
+    lengths = numpy.char.str_len(inputs)
+
+    trans = numpy.array(table.trans, dtype=numpy.intp)
+    accept = numpy.array(bytearray(table.accept), dtype=bool)
+    eoi_accept = numpy.array(bytearray(table.eoi_accept), dtype=bool)
+    k = table.nclasses
+
+    state = numpy.full(n, table.start, dtype=numpy.intp)
+    matched = accept[state]
+    done = matched | (state == 0)
+    for j in range(width):
+        # the inputs that are still running and have a character at j
+        rows = numpy.flatnonzero(~done & (lengths > j))
+        if not len(rows):
+            break
+        s = trans[state[rows]*k + classify(codes[rows, j])]
+        state[rows] = s
+        hit = accept[s]
+        matched[rows[hit]] = True
+        done[rows[hit | (s == 0)]] = True
+    # the inputs that ran to their end accept if their last state does there
+    return matched | (~done & eoi_accept[state])
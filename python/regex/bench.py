@@ -0,0 +1,229 @@
+# bench.py
+# Benchmarks the regex compiler and matcher against the stdlib re module
+#
+#   python bench.py [-o results.json] [--size BYTES] [--repeat N] [NAME...]
+#
+# Every phase of compiling a pattern is timed separately, the automata sizes
+# are recorded, and matching speed is measured in MB/s on generated corpora.
+# The corpora are built from a fixed seed so runs can be compared; the
+# results are written as JSON to track regressions.
+
+import argparse
+import json
+import platform
+import random
+import re as stdlib_re
+import sys
+
+from automaton import StateLimitError
+from dfatable import DFATable
+import regex
+
+default_size = 1 << 18 # bytes in each corpus
+default_repeat = 3 # each measurement is the best of this many runs
+
+#---- Patterns ----#
+# (name, regex, kind) where kind is "common" or "pathological"
+patterns = [
+    ("literal", r"error", "common"),
+    ("email", r"\w+@\w+\.(ca|com|net|org)", "common"),
+    ("ip", r"[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+", "common"),
+    ("timestamp", r"^[0-9]+-[0-9]+-[0-9]+ [0-9]+:[0-9]+", "common"),
+    ("status", r" (4|5)[0-9][0-9] ", "common"),
+    ("words", r"(foo|bar)\w*baz", "common"),
+    ("nested_stars", r"((a*)*b*)*c", "pathological"),
+    ("nested_plus", r"(x+x+)+y", "pathological"),
+    ("counted", r"a{2,60}b", "pathological"),
+    ("counted_dfa_blowup", r"(a|b)*a(a|b){10,10}", "pathological"),
+    ("long_alternation", "(" + "|".join(
+        "w%03dx" % i for i in range(200)) + ")", "pathological"),
+]
+
+# (pattern, corpus) pairs the stdlib's backtracking takes exponential time
+# on; the stdlib isn't run on them and its results are None
+stdlib_exponential = set([("nested_stars", "pathological")])
+
+#---- Corpora ----#
+def text_corpus(size, seed=0):
+    """ Returns size bytes of random lowercase words """
+    rand = random.Random(seed)
+    words = []
+    n = 0
+    while n < size:
+        word = "".join(rand.choice("abcdefghijklmnopqrstuvwxyz")
+                for i in range(rand.randint(1, 10)))
+        words.append(word)
+        n += len(word) + 1
+    lines = [" ".join(words[i:i+12]) for i in range(0, len(words), 12)]
+    return "\n".join(lines)[:size]
+
+def log_corpus(size, seed=0):
+    """ Returns size bytes of web server log lines """
+    rand = random.Random(seed)
+    levels = ["INFO", "INFO", "INFO", "WARN", "error"]
+    lines = []
+    n = 0
+    while n < size:
+        line = "2016-%02d-%02d %02d:%02d:%02d %s 10.0.%d.%d GET /p/%d %d " \
+            "user%d@host%d.com" % (rand.randint(1, 12), rand.randint(1, 28),
+                rand.randint(0, 23), rand.randint(0, 59), rand.randint(0, 59),
+                rand.choice(levels), rand.randint(0, 255), rand.randint(0, 255),
+                rand.randint(0, 9999), rand.choice([200, 200, 301, 404, 503]),
+                rand.randint(0, 999), rand.randint(0, 99))
+        lines.append(line)
+        n += len(line) + 1
+    return "\n".join(lines)[:size]
+
+def pathological_corpus(size, seed=0):
+    """ Returns size bytes of the characters the pathological patterns
+        loop on, in lines of 100
+
+        The lines are kept short because backtracking matchers, like the
+        stdlib's, can take quadratic time in the length of a line
+    """
+    rand = random.Random(seed)
+    chars = [rand.choice("aaaabxw0") for i in range(size)]
+    for i in range(100, size, 101):
+        chars[i] = "\n"
+    return "".join(chars)
+
+corpora = [
+    ("text", text_corpus),
+    ("log", log_corpus),
+    ("pathological", pathological_corpus),
+]
+
+#---- Measurements ----#
+def best_time(func, repeat):
+    """ Returns the shortest of repeat timings of func() and its result
+
+        It is timed with the clock of Pattern.stats, so the two can be
+        compared
+    """
+    best = None
+    for i in range(repeat):
+        start = regex._timer()
+        result = func()
+        elapsed = regex._timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def compile_phases(myregex, repeat):
+    """ Times each phase of compiling myregex and counts the states of the
+        automata it builds
+    """
+    result = {}
+    result["parse"], tree = best_time(lambda: regex.parse(myregex), repeat)
+    result["nfa"], nfa = best_time(lambda: regex.ast_to_nfa(tree), repeat)
+    result["nfa_states"] = len(nfa.get_states())
+    try:
+        result["dfa"], dfa = best_time(
+                lambda: nfa.to_dfa(max_states=regex.max_dfa_states), repeat)
+    except StateLimitError:
+        result["dfa"] = result["dfa_states"] = None
+        result["table"] = result["minimize"] = result["table_states"] = None
+        return result
+    result["dfa_states"] = len(dfa)
+    result["table"], table = best_time(lambda: DFATable.from_dfa(dfa), repeat)
+    result["minimize"], table = best_time(table.minimize, repeat)
+    result["table_states"] = table.nstates
+    return result
+
+def throughput(size, elapsed):
+    # MB/s, or None when the run was too quick to time
+    return size / elapsed / 1e6 if elapsed else None
+
+def bench_pattern(name, myregex, kind, inputs, repeat):
+    """ Returns the results for one pattern: compile times, automata sizes
+        and matching speed on each corpus, next to the stdlib's
+    """
+    result = {"name": name, "regex": myregex, "kind": kind}
+    result["compile"] = compile_phases(myregex, repeat)
+    def build():
+        # all the tables, since the search and reverse tables are otherwise
+        # built by the first search and findall
+        pattern = regex.compile(myregex)
+        pattern.search_table
+        pattern.reverse_table
+        return pattern
+    result["compile"]["total"], pattern = best_time(build, repeat)
+    result["engine"] = pattern.engine
+    result["stdlib_compile"], expected = best_time(
+            lambda: stdlib_re.compile(myregex), repeat)
+
+    result["matching"] = []
+    for corpus, text in inputs:
+        lines = text.split("\n")
+        ops = [
+            # search every line, like grep
+            ("search_lines",
+                lambda: sum(1 for l in lines if pattern.search(l)),
+                lambda: sum(1 for l in lines if expected.search(l))),
+            # the same with one call for all the lines
+            ("search_lines_batch",
+                lambda: sum(pattern.search_many(lines)),
+                lambda: sum(1 for l in lines if expected.search(l))),
+            # all the matches in the whole corpus
+            ("findall",
+                lambda: len(pattern.findall(text)),
+                lambda: len(expected.findall(text))),
+        ]
+        for op, func, stdlib_func in ops:
+            elapsed, count = best_time(func, repeat)
+            if (name, corpus) in stdlib_exponential:
+                stdlib_elapsed = stdlib_count = None
+            else:
+                stdlib_elapsed, stdlib_count = best_time(stdlib_func, repeat)
+            result["matching"].append({
+                "corpus": corpus,
+                "op": op,
+                "mb_per_s": throughput(len(text), elapsed),
+                "stdlib_mb_per_s": throughput(len(text), stdlib_elapsed),
+                "matches": count,
+                "stdlib_matches": stdlib_count,
+            })
+    return result
+
+def run(size=default_size, repeat=default_repeat, names=None):
+    """ Runs the benchmarks of the patterns named in names (all of them by
+        default) and returns the results as a dict
+    """
+    inputs = [(name, make(size)) for name, make in corpora]
+    results = []
+    for name, myregex, kind in patterns:
+        if names and name not in names:
+            continue
+        results.append(bench_pattern(name, myregex, kind, inputs, repeat))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size": size,
+        "repeat": repeat,
+        "results": results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Benchmarks the regex compiler and matcher")
+    parser.add_argument("names", metavar="NAME", nargs="*",
+            help="the patterns to run (default: all of them): %s" %
+            ", ".join(p[0] for p in patterns))
+    parser.add_argument("-o", "--output", default=None,
+            help="the file to write the JSON results to (default: stdout)")
+    parser.add_argument("--size", type=int, default=default_size,
+            help="bytes in each corpus")
+    parser.add_argument("--repeat", type=int, default=default_repeat,
+            help="runs of each measurement, the best one is kept")
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.repeat, args.names)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# charclass.py
+# Character sets for transition labels and the alphabet partition used by the
+# table-driven matcher
+
+import mmap
+import sys
+from bisect import bisect_right
+from itertools import islice
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+# inputs holding bytes that are matched by their values; on Python 2 str,
+# mmap and memoryview are matched like strings
+if bytes is str:
+    byte_types = (bytearray,)
+else:
+    byte_types = (bytes, bytearray, memoryview, mmap.mmap)
+
+def byte_input(inp):
+    """ Returns true if inp is bytes rather than a string """
+    return isinstance(inp, byte_types)
+
+def suffix(inp, pos):
+    """ Returns an iterable over inp[pos:] that neither copies inp nor
+        steps through its first pos items, where possible
+    """
+    if pos == 0:
+        return inp
+    if byte_input(inp):
+        return memoryview(inp)[pos:]
+    it = iter(inp)
+    if hasattr(it, "__setstate__"):
+        # the iterators of str and list can be moved to pos directly
+        it.__setstate__(pos)
+        return it
+    return islice(it, pos, None)
+
+def backwards(inp):
+    """ Returns an iterable over inp from its last item to its first,
+        without copying inp
+    """
+    try:
+        return reversed(inp)
+    except TypeError:
+        # Python 2 memoryviews can be indexed but not reversed
+        return (inp[i] for i in range(len(inp) - 1, -1, -1))
+
+#---- Constants ----#
+max_codepoint = sys.maxunicode
+char_class_map = {
+    "\\s": "[ \t]",
+    "\\w": "[0-9a-zA-Z_]"
+}
+anchors = ["^","$"]
+max_classmap_size = 4096 # characters a ClassMap keeps the class id of
+max_cached_alphabets = 64 # alphabets kept by alphabet_for
+
+
+#---- Character Sets ----#
+class CharSet(object):
+    """ A set of characters stored as sorted, disjoint (lo, hi) ranges of
+        codepoints; both ends of a range are inclusive
+    """
+    def __init__(self, ranges=()):
+        self.ranges = _normalize(ranges)
+
+    @classmethod
+    def from_label(cls, label):
+        """ Returns the CharSet matched by a transition label
+
+            A label is one regex token: a character (a), an escape (\\. \\w),
+            a character class ([a-z] [^abc]) or the wildcard (.)
+        """
+        if label == ".":
+            return cls([(0, max_codepoint)])
+        if label.startswith("[") and len(label) > 1:
+            return cls.from_class(label)
+        if label.startswith("\\") and len(label) > 1:
+            cc = char_class_map.get(label)
+            if cc:
+                return cls.from_class(cc)
+            label = label[1:]
+        if len(label) != 1:
+            raise ValueError("bad label: %s" % label)
+        return cls([(ord(label), ord(label))])
+
+    @classmethod
+    def from_class(cls, cc):
+        """ Returns the CharSet of a character class like [abc] or [^a-z] """
+        if not (cc.startswith("[") and cc.endswith("]")):
+            raise ValueError("bad character class: %s" % cc)
+        cc = cc[1:-1]
+
+        negate = cc.startswith("^")
+        if negate:
+            cc = cc[1:]
+
+        ranges = []
+        i = 0
+        while i < len(cc):
+            if i+2 < len(cc) and cc[i+1] == "-":
+                lo, hi = ord(cc[i]), ord(cc[i+2])
+                if lo > hi:
+                    raise ValueError("bad character range: %s" % cc[i:i+3])
+                ranges.append((lo, hi))
+                i += 3
+            else:
+                ranges.append((ord(cc[i]), ord(cc[i])))
+                i += 1
+
+        charset = cls(ranges)
+        return charset.complement() if negate else charset
+
+    def complement(self):
+        """ Returns the set of every codepoint not in this set """
+        ranges = []
+        lo = 0
+        for r_lo, r_hi in self.ranges:
+            if r_lo > lo:
+                ranges.append((lo, r_lo-1))
+            lo = r_hi+1
+        if lo <= max_codepoint:
+            ranges.append((lo, max_codepoint))
+        return CharSet(ranges)
+
+    def to_label(self):
+        """ Returns a label for the set, e.g. a, \\. or [a-z_]
+
+            Sets that contain the last codepoint are written as a negated
+            class, e.g. [^\\n]
+        """
+        if len(self.ranges) == 1 and self.ranges[0][0] == self.ranges[0][1]:
+            c = _unichr(self.ranges[0][0])
+            return "\\" + c if c in ".[\\^$" else c
+        if self.ranges and self.ranges[-1][1] == max_codepoint:
+            return "[^%s]" % _ranges_to_str(self.complement().ranges)
+        return "[%s]" % _ranges_to_str(self.ranges)
+
+    def union(self, other):
+        return CharSet(self.ranges + other.ranges)
+
+    def contains(self, o):
+        """ Returns true if codepoint o is in the set """
+        i = bisect_right(self.ranges, (o, max_codepoint)) - 1
+        return i >= 0 and self.ranges[i][1] >= o
+
+    def __contains__(self, c):
+        return self.contains(ord(c))
+
+    def __eq__(self, other):
+        return isinstance(other, CharSet) and self.ranges == other.ranges
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self.ranges))
+
+    def __repr__(self):
+        return "CharSet(%r)" % self.ranges
+
+def _normalize(ranges):
+    # sorts the ranges and merges the ones that touch or overlap
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]+1:
+            if hi > merged[-1][1]:
+                merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def _ranges_to_str(ranges):
+    def esc(o):
+        c = _unichr(o)
+        return "\\" + c if c in "\\]-^" else c
+    out = []
+    for lo, hi in ranges:
+        out.append(esc(lo))
+        if hi > lo+1:
+            out.append("-")
+        if hi > lo:
+            out.append(esc(hi))
+    return "".join(out)
+
+
+#---- Alphabet Partition ----#
+class ClassMap(dict):
+    """ Maps a character (or a codepoint) to its class id
+
+        Entries are filled in on first lookup so the common case in the
+        matching loop is a single dict lookup. Only the first
+        max_classmap_size characters looked up are kept, so Unicode text
+        can't grow it without bound; the others are looked up every time.
+    """
+    def __init__(self, bounds, ids):
+        super(ClassMap, self).__init__()
+        self.bounds = bounds
+        self.ids = ids
+
+    def __missing__(self, c):
+        o = c if isinstance(c, int) else ord(c)
+        cid = self.ids[bisect_right(self.bounds, o) - 1]
+        if len(self) < max_classmap_size:
+            self[c] = cid
+        return cid
+
+class Alphabet(object):
+    """ Partitions the codepoints into disjoint equivalence classes
+
+        Two characters are in the same class when exactly the same labels
+        match them. Class 0 holds the characters that no label matches.
+    """
+    def __init__(self, labels):
+        self.labels = sorted(set(labels))
+        charsets = [CharSet.from_label(l) for l in self.labels]
+
+        # split the codepoints into intervals at every range boundary; a
+        # label starts or stops matching at each of its boundaries (the
+        # ranges of a label neither overlap nor touch)
+        events = {0: []}
+        for l, cs in zip(self.labels, charsets):
+            for lo, hi in cs.ranges:
+                events.setdefault(lo, []).append(l)
+                events.setdefault(hi+1, []).append(l)
+        bounds = sorted(p for p in events if p <= max_codepoint)
+
+        # intervals matched by the same labels share a class id; the labels
+        # matching each interval are kept up to date in one sweep
+        signature_ids = {frozenset(): 0}
+        self.signatures = [frozenset()]
+        ids = []
+        active = set()
+        for lo in bounds:
+            active.symmetric_difference_update(events[lo])
+            sig = frozenset(active)
+            if sig not in signature_ids:
+                signature_ids[sig] = len(self.signatures)
+                self.signatures.append(sig)
+            ids.append(signature_ids[sig])
+
+        self.nclasses = len(self.signatures)
+        self.classmap = ClassMap(bounds, ids)
+        self._byte_classes = None
+
+        # the characters of each class, and a label naming it
+        class_ranges = [[] for sig in self.signatures]
+        for i, lo in enumerate(bounds):
+            hi = bounds[i+1]-1 if i+1 < len(bounds) else max_codepoint
+            class_ranges[ids[i]].append((lo, hi))
+        self.class_labels = [CharSet(r).to_label() for r in class_ranges]
+
+        self._label_classes = dict((l, []) for l in self.labels)
+        for cid, sig in enumerate(self.signatures):
+            for l in sig:
+                self._label_classes[l].append(cid)
+
+    @classmethod
+    def from_classmap(cls, bounds, ids, nclasses):
+        """ Rebuilds the alphabet of a saved table from its class boundaries
+            and ids; it can only classify characters, the labels are not kept
+        """
+        alphabet = cls.__new__(cls)
+        alphabet.labels = None
+        alphabet.signatures = None
+        alphabet.nclasses = nclasses
+        alphabet.classmap = ClassMap(bounds, ids)
+        alphabet._byte_classes = None
+        alphabet.class_labels = None
+        alphabet._label_classes = None
+        return alphabet
+
+    def classify(self, c):
+        """ Returns the class id of character c """
+        return self.classmap[c]
+
+    def classmap_for(self, inp):
+        """ Returns what maps the items of inp to class ids: for byte input a
+            list indexed by the byte value, otherwise the classmap
+        """
+        if not byte_input(inp) or isinstance(inp, mmap.mmap):
+            # an mmap yields one byte strings, the classmap takes their ord
+            return self.classmap
+        if self._byte_classes is None:
+            self._byte_classes = [self.classmap[b] for b in range(256)]
+        return self._byte_classes
+
+    def label_classes(self, label):
+        """ Returns the ids of the classes matched by the given label """
+        return self._label_classes[label]
+
+_alphabets = {}
+
+def alphabet_for(labels):
+    """ Returns the Alphabet of the labels that aren't anchors
+
+        The tables of a pattern (match, search, reverse) have the same
+        labels, so the alphabets of the last max_cached_alphabets label sets
+        are kept and shared rather than partitioned again
+    """
+    key = frozenset(l for l in labels if l not in anchors)
+    alphabet = _alphabets.get(key)
+    if alphabet is None:
+        if len(_alphabets) >= max_cached_alphabets:
+            _alphabets.clear()
+        alphabet = _alphabets[key] = Alphabet(key)
+    return alphabet
@@ -0,0 +1,271 @@
+# dfatable.py
+# A compiled, table-driven form of a DFA
+#
+# States are integers and the transitions are a flat list indexed by
+# state * nclasses + class id, so matching costs one lookup per character
+
+from charclass import backwards, suffix
+
+class DFATable(object):
+    """ A DFA compiled to integer state ids and dense transition arrays
+
+        State 0 is the dead state: every transition out of it leads back to
+        it and it never accepts. It replaces the missing transitions of the
+        DFA it was built from.
+
+        trans       - flat list, trans[s*nclasses + cid] is the next state
+        accept      - accept[s] is 1 if state s is an accept state
+        eoi_accept  - eoi_accept[s] is 1 if s accepts at the end of the input
+                      (including through a $ anchor)
+        start       - the id of the start state at the beginning of the input
+        inner_start - the id of the start state anywhere else
+        alphabet    - maps characters to class ids
+
+        original_nstates is the number of states the table had before it was
+        minimized
+    """
+    engine = "dfa"
+
+    def __init__(self, trans, accept, eoi_accept, start, inner_start,
+            alphabet):
+        self.trans = trans
+        self.accept = accept
+        self.eoi_accept = eoi_accept
+        self.start = start
+        self.inner_start = inner_start
+        self.alphabet = alphabet
+        self.nclasses = alphabet.nclasses
+        self.original_nstates = self.nstates
+
+    @classmethod
+    def from_dfa(cls, dfa):
+        """ Builds the table for a DFA returned by NFA.to_dfa
+
+            States that can't reach an accept state are left out; their
+            transitions go to the dead state, so walks stop as soon as a
+            match is no longer possible
+        """
+        states = _live_states(dfa.states())
+        ids = dict((s, i+1) for i,s in enumerate(states))
+        alphabet = dfa.alphabet
+        class_ids = dict((l, cid) for cid,l in enumerate(alphabet.class_labels))
+
+        k = alphabet.nclasses
+        n = len(states) + 1
+        trans = [0] * (n*k)
+        accept = bytearray(n)
+        eoi_accept = bytearray(n)
+        for s in states:
+            sid = ids[s]
+            for label, nxt in s.adj():
+                trans[sid*k + class_ids[label]] = ids.get(nxt, 0)
+            accept[sid] = s.is_accept()
+            eoi_accept[sid] = s.is_eoi_accept()
+
+        return cls(trans, accept, eoi_accept, ids.get(dfa.get_start_state(), 0),
+                ids.get(dfa.inner_start, 0), alphabet)
+
+    @property
+    def nstates(self):
+        """ The number of states, including the dead state """
+        return len(self.accept)
+
+    def minimize(self):
+        """ Returns an equivalent table with the fewest states
+
+            Equivalent states are merged with Hopcroft's partition refinement
+            algorithm. States that can never reach an accept state end up in
+            the dead state.
+        """
+        n = self.nstates
+        k = self.nclasses
+        trans = self.trans
+
+        # inverse[c][t] lists the states that go to t on class c
+        inverse = [[[] for t in range(n)] for c in range(k)]
+        for s in range(n):
+            for c in range(k):
+                inverse[c][trans[s*k + c]].append(s)
+
+        # start from the partition into accepting and non-accepting states
+        groups = {}
+        for s in range(n):
+            key = (self.accept[s], self.eoi_accept[s])
+            groups.setdefault(key, set()).add(s)
+        blocks = list(groups.values())
+        block_of = [0] * n
+        for b, states in enumerate(blocks):
+            for s in states:
+                block_of[s] = b
+
+        work = set((b, c) for b in range(len(blocks)) for c in range(k))
+        while work:
+            b, c = work.pop()
+            # split every block by whether its states go into b on c
+            preds = {}
+            for t in blocks[b]:
+                for s in inverse[c][t]:
+                    preds.setdefault(block_of[s], set()).add(s)
+            for y, inside in preds.items():
+                if len(inside) == len(blocks[y]):
+                    continue
+                blocks[y] -= inside
+                z = len(blocks)
+                blocks.append(inside)
+                for s in inside:
+                    block_of[s] = z
+                for d in range(k):
+                    if (y, d) in work or len(inside) <= len(blocks[y]):
+                        work.add((z, d))
+                    else:
+                        work.add((y, d))
+
+        # renumber the blocks, keeping the dead state's block at 0
+        order = [block_of[0]] + [b for b in range(len(blocks))
+                if b != block_of[0]]
+        new_id = [0] * len(blocks)
+        for i, b in enumerate(order):
+            new_id[b] = i
+
+        m = len(blocks)
+        new_trans = [0] * (m*k)
+        accept = bytearray(m)
+        eoi_accept = bytearray(m)
+        for b in order:
+            rep = next(iter(blocks[b]))
+            sid = new_id[b]
+            for c in range(k):
+                new_trans[sid*k + c] = new_id[block_of[trans[rep*k + c]]]
+            accept[sid] = self.accept[rep]
+            eoi_accept[sid] = self.eoi_accept[rep]
+
+        table = DFATable(new_trans, accept, eoi_accept,
+                new_id[block_of[self.start]],
+                new_id[block_of[self.inner_start]], self.alphabet)
+        table.original_nstates = self.original_nstates
+        return table
+
+    def find_end(self, inp, pos=0, longest=False):
+        """ Walks the table over inp[pos:] and returns the index in inp where
+            the first accepted prefix ends, or -1 if there is none
+
+            With longest the walk goes on until the dead state or the end of
+            the input and the end of the longest accepted prefix is returned
+
+            For the table of an unanchored DFA this is where the earliest
+            ending match in inp[pos:] ends
+        """
+        trans = self.trans
+        accept = self.accept
+        rest = suffix(inp, pos)
+        classmap = self.alphabet.classmap_for(rest)
+        k = self.nclasses
+
+        s = self.start if pos == 0 else self.inner_start
+        last = -1
+        if accept[s]:
+            if not longest:
+                return pos
+            last = pos
+        i = pos
+        for c in rest:
+            s = trans[s*k + classmap[c]]
+            i += 1
+            if accept[s]:
+                if not longest:
+                    return i
+                last = i
+            elif not s:
+                return last
+        return i if self.eoi_accept[s] else last
+
+    def match(self, inp, pos=0):
+        """ Returns true if a prefix of inp[pos:] is accepted """
+        return self.find_end(inp, pos) != -1
+
+    def find_starts(self, inp):
+        """ Walks the table over inp backwards, from its end to its
+            beginning, and returns the indexes i where the walk over inp[i:]
+            is accepted, in increasing order
+
+            For the unanchored table of a reversed NFA (see NFA.reverse)
+            these are the indexes where a match of the NFA starts
+        """
+        trans = self.trans
+        accept = self.accept
+        classmap = self.alphabet.classmap_for(inp)
+        k = self.nclasses
+
+        s = self.start
+        starts = []
+        i = len(inp)
+        for c in backwards(inp):
+            if accept[s]:
+                starts.append(i)
+            elif not s:
+                break
+            s = trans[s*k + classmap[c]]
+            i -= 1
+        else:
+            if self.eoi_accept[s]:
+                starts.append(0)
+        starts.reverse()
+        return starts
+
+    def stream_start(self):
+        """ Returns the state feed starts from at the beginning of the input """
+        return self.start
+
+    def stream_start_match(self):
+        """ Returns the state feed goes on from after an empty match at the
+            beginning of the input, or None if there is no such match
+        """
+        return self.inner_start if self.accept[self.start] else None
+
+    def feed(self, chunk, state, offset):
+        """ Walks chunk from state, where offset is the position of chunk in
+            the whole input
+
+            Every time a character takes the walk to an accept state its end
+            position is recorded and the walk restarts from the inner start
+            state. Returns the state the walk ended in and the list of end
+            positions.
+        """
+        trans = self.trans
+        accept = self.accept
+        classmap = self.alphabet.classmap_for(chunk)
+        k = self.nclasses
+        inner_start = self.inner_start
+
+        s = state
+        ends = []
+        i = offset
+        for c in chunk:
+            s = trans[s*k + classmap[c]]
+            i += 1
+            if accept[s]:
+                ends.append(i)
+                s = inner_start
+        return s, ends
+
+    def stream_eoi_accept(self, state):
+        """ Returns true if state accepts at the end of the input """
+        return bool(self.eoi_accept[state])
+
+def _live_states(states):
+    # returns the states an accept state can be reached from
+    states = list(states)
+    preds = dict((s, []) for s in states)
+    for s in states:
+        for label, nxt in s.adj():
+            preds[nxt].append(s)
+
+    live = set(s for s in states if s.is_accept() or s.is_eoi_accept())
+    stack = list(live)
+    while stack:
+        v = stack.pop()
+        for u in preds[v]:
+            if u not in live:
+                live.add(u)
+                stack.append(u)
+    return [s for s in states if s in live]
@@ -0,0 +1,165 @@
+# grep.py
+# A grep-like command line tool: python -m regex [options] PATTERN [PATH...]
+#
+# The pattern is compiled once. Its tables are serialized and handed to the
+# worker processes, which load them rather than compiling the pattern again,
+# and each worker scans whole files. Files are read as bytes and matched by
+# byte value, so nothing is decoded.
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import regex
+import serialize
+
+stdin_name = "(standard input)"
+
+_pattern = None # the Pattern of a worker process
+
+def scan(pattern, f, mode="lines"):
+    """ Searches the lines of the binary file f for pattern
+
+        Returns the number of matching lines and, in "lines" mode, a list
+        of the (line number, line) of each one. In "files" mode the search
+        stops at the first matching line.
+    """
+    count = 0
+    matches = []
+    for lineno, line in enumerate(f, 1):
+        if pattern.search(line.rstrip(b"\n")):
+            count += 1
+            if mode == "lines":
+                matches.append((lineno, line))
+            elif mode == "files":
+                break
+    return count, matches
+
+def walk(paths):
+    """ Yields the files named by paths, and the files in the directory
+        trees they name, in sorted order
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+def _dump(pattern):
+    # only dfa tables can be serialized; with other engines the workers
+    # compile the regex themselves, with the engine it was compiled with
+    # (None lets them pick each table's engine again)
+    try:
+        return ("tables", serialize.dumps(pattern))
+    except ValueError:
+        return ("regex", pattern.pattern, pattern._engine)
+
+def _init_worker(data):
+    global _pattern
+    if data[0] == "tables":
+        _pattern = serialize.loads(data[1])
+    else:
+        _pattern = regex.compile(data[1], engine=data[2])
+
+def _scan_file(path, mode, pattern=None):
+    # returns (path, count, matches, error) for the file at path
+    try:
+        with open(path, "rb") as f:
+            count, matches = scan(pattern or _pattern, f, mode)
+        return path, count, matches, None
+    except (IOError, OSError) as e:
+        return path, 0, [], e.strerror or str(e)
+
+def _scan_task(args):
+    return _scan_file(*args)
+
+def _fsencode(s):
+    return s if isinstance(s, bytes) else s.encode("utf-8", "surrogateescape")
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="python -m regex",
+            description="Prints the lines of the files that match PATTERN")
+    parser.add_argument("pattern", metavar="PATTERN")
+    parser.add_argument("paths", metavar="PATH", nargs="*",
+            help="a file, or a directory to search recursively; - or no "
+            "PATH reads the standard input")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-c", "--count", action="store_true",
+            help="print only the number of matching lines of each file")
+    mode.add_argument("-l", "--files-with-matches", action="store_true",
+            help="print only the names of the files with a match")
+    parser.add_argument("-n", "--line-number", action="store_true",
+            help="print the line number before each line")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+            help="number of worker processes (default: number of cores)")
+    parser.add_argument("--engine", choices=regex.engines, default=None,
+            help="matching engine (see regex.Pattern)")
+    return parser
+
+def main(argv=None, out=None):
+    """ Runs the command line tool and returns its exit status: 0 if a line
+        matched, 1 if none did, 2 if a file couldn't be read
+    """
+    args = _parser().parse_args(argv)
+    if out is None:
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+    if args.count:
+        mode = "count"
+    elif args.files_with_matches:
+        mode = "files"
+    else:
+        mode = "lines"
+
+    # the lines are bytes, so the pattern is too
+    pattern = regex.compile(_fsencode(args.pattern), engine=args.engine)
+    paths = args.paths or ["-"]
+    with_names = len(paths) > 1 or any(os.path.isdir(p) for p in paths)
+    files = list(walk(p for p in paths if p != "-"))
+    jobs = args.jobs or multiprocessing.cpu_count()
+
+    def results():
+        if "-" in paths:
+            stdin = getattr(sys.stdin, "buffer", sys.stdin)
+            count, matches = scan(pattern, stdin, mode)
+            yield stdin_name, count, matches, None
+        if jobs <= 1 or len(files) <= 1:
+            for path in files:
+                yield _scan_file(path, mode, pattern)
+            return
+        pool = multiprocessing.Pool(jobs, _init_worker, (_dump(pattern),))
+        try:
+            for result in pool.imap(_scan_task,
+                    [(path, mode) for path in files], chunksize=4):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    status = 1
+    for path, count, matches, error in results():
+        if error is not None:
+            sys.stderr.write("%s: %s\n" % (path, error))
+            status = 2
+            continue
+        if count and status == 1:
+            status = 0
+        name = _fsencode(path)
+        if mode == "count":
+            out.write((name + b":" if with_names else b"") +
+                    str(count).encode("ascii") + b"\n")
+        elif mode == "files":
+            if count:
+                out.write(name + b"\n")
+        else:
+            for lineno, line in matches:
+                prefix = name + b":" if with_names else b""
+                if args.line_number:
+                    prefix += str(lineno).encode("ascii") + b":"
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                out.write(prefix + line)
+    return status
@@ -0,0 +1,213 @@
+# lazydfa.py
+# A DFA that is determinized on demand while matching
+#
+# NFA.to_dfa builds every DFA state up front, which is exponential for
+# patterns like (a|b)*a(a|b){20,20}. A LazyDFA only builds the states the
+# input actually reaches and keeps them in a bounded cache, so matching stays
+# linear in the input with capped memory.
+
+from charclass import alphabet_for, anchors, backwards, suffix
+
+max_lazy_states = 10000 # states cached before the cache is flushed
+
+class LazyDFA(object):
+    """ A DFA over the states of an NFA that is built while it is walked
+
+        It has the same find_end/match interface as a DFATable. States get
+        integer ids in the order they are reached; transitions that have not
+        been computed yet are -1. When more than max_states states are cached
+        the cache is flushed and rebuilt from the state being walked.
+
+        State 0 is the dead state, like in a DFATable. NFA states that can't
+        reach an accept state are dropped from the substates, so a state
+        with no hope of matching is the dead state.
+    """
+    engine = "lazy"
+
+    def __init__(self, nfa, unanchored=False, max_states=max_lazy_states):
+        self.nfa = nfa
+        self.max_states = max(max_states, 2)
+        labels = nfa.transition_values(nfa.get_states())
+        self.alphabet = alphabet_for(labels)
+        self.nclasses = self.alphabet.nclasses
+        self._label_classes = dict((l, set(self.alphabet.label_classes(l)))
+                for l in self.alphabet.labels)
+
+        self._closures = {}
+        self._live = frozenset(nfa.live_states())
+        start = nfa.get_start_state()
+        self._start_substates = self._live_closure({start}, "^")
+        self._inner_substates = self._live_closure({start})
+        self._restart = self._inner_substates if unanchored else frozenset()
+
+        self.flushes = 0
+        self.trans = []
+        self.accept = bytearray()
+        self.eoi_accept = bytearray()
+        self._ids = {}
+        self._substates = []
+        self._flush()
+
+    @property
+    def nstates(self):
+        """ The number of states in the cache, including the dead state """
+        return len(self._substates)
+
+    def _flush(self):
+        # empties the cache in place so the lists held by find_end stay valid
+        del self.trans[:]
+        del self.accept[:]
+        del self.eoi_accept[:]
+        self._ids.clear()
+        del self._substates[:]
+        dead = self._add_state(frozenset())
+        for cid in range(self.nclasses):
+            self.trans[dead*self.nclasses + cid] = dead
+
+    def _add_state(self, substates):
+        if len(self._substates) >= self.max_states:
+            self.flushes += 1
+            self._flush()
+        sid = len(self._substates)
+        self._ids[substates] = sid
+        self._substates.append(substates)
+        self.trans.extend([-1] * self.nclasses)
+        accepts = self.nfa.accepts
+        self.accept.append(any(accepts(s) for s in substates))
+        eoi = self._null_closure(substates, "$")
+        self.eoi_accept.append(any(accepts(s) for s in eoi))
+        return sid
+
+    def _null_closure(self, states, assertions=()):
+        # the closures of single NFA states are kept across cache flushes
+        return self.nfa.null_closure(states, assertions, self._closures)
+
+    def _live_closure(self, states, assertions=()):
+        return frozenset(self._null_closure(states, assertions)) & self._live
+
+    def _state_id(self, substates):
+        sid = self._ids.get(substates)
+        if sid is None:
+            sid = self._add_state(substates)
+        return sid
+
+    def _next_state(self, sid, cid):
+        # determinizes the transition of state sid on class cid
+        nxt = set()
+        for s in self._substates[sid]:
+            for trans, v in self.nfa.labelled_transitions(s):
+                if trans not in anchors and cid in self._label_classes[trans]:
+                    nxt.add(v)
+        substates = self._live_closure(nxt) | self._restart
+
+        flushes = self.flushes
+        tid = self._state_id(substates)
+        if flushes == self.flushes:
+            self.trans[sid*self.nclasses + cid] = tid
+        return tid
+
+    def find_end(self, inp, pos=0, longest=False):
+        """ Returns the index in inp where the first (or with longest, the
+            longest) accepted prefix of inp[pos:] ends, or -1 if there is
+            none; see DFATable.find_end
+        """
+        trans = self.trans
+        accept = self.accept
+        rest = suffix(inp, pos)
+        classmap = self.alphabet.classmap_for(rest)
+        k = self.nclasses
+
+        s = self._state_id(self._start_substates if pos == 0
+                else self._inner_substates)
+        last = -1
+        if accept[s]:
+            if not longest:
+                return pos
+            last = pos
+        i = pos
+        for c in rest:
+            cid = classmap[c]
+            t = trans[s*k + cid]
+            if t < 0:
+                t = self._next_state(s, cid)
+            s = t
+            i += 1
+            if accept[s]:
+                if not longest:
+                    return i
+                last = i
+            elif not s:
+                return last
+        return i if self.eoi_accept[s] else last
+
+    def match(self, inp, pos=0):
+        """ Returns true if a prefix of inp[pos:] is accepted """
+        return self.find_end(inp, pos) != -1
+
+    def find_starts(self, inp):
+        """ Returns the indexes i where the walk over inp[i:] backwards is
+            accepted; see DFATable.find_starts
+        """
+        trans = self.trans
+        accept = self.accept
+        classmap = self.alphabet.classmap_for(inp)
+        k = self.nclasses
+
+        s = self._state_id(self._start_substates)
+        starts = []
+        i = len(inp)
+        for c in backwards(inp):
+            if accept[s]:
+                starts.append(i)
+            elif not s:
+                break
+            cid = classmap[c]
+            t = trans[s*k + cid]
+            if t < 0:
+                t = self._next_state(s, cid)
+            s = t
+            i -= 1
+        else:
+            if self.eoi_accept[s]:
+                starts.append(0)
+        starts.reverse()
+        return starts
+
+    # The state kept between feeds is a set of substates rather than an id,
+    # since ids don't survive a cache flush
+    def stream_start(self):
+        """ Returns the state feed starts from; see DFATable.feed """
+        return self._start_substates
+
+    def stream_start_match(self):
+        """ See DFATable.stream_start_match """
+        if self.accept[self._state_id(self._start_substates)]:
+            return self._inner_substates
+        return None
+
+    def feed(self, chunk, state, offset):
+        """ Walks chunk from state; see DFATable.feed """
+        trans = self.trans
+        accept = self.accept
+        classmap = self.alphabet.classmap_for(chunk)
+        k = self.nclasses
+        inner_start = self._inner_substates
+
+        s = self._state_id(state)
+        ends = []
+        i = offset
+        for c in chunk:
+            cid = classmap[c]
+            t = trans[s*k + cid]
+            if t < 0:
+                t = self._next_state(s, cid)
+            s = t
+            i += 1
+            if accept[s]:
+                ends.append(i)
+                s = self._state_id(inner_start)
+        return self._substates[s], ends
+
+    def stream_eoi_accept(self, state):
+        """ Returns true if state accepts at the end of the input """
+        return bool(self.eoi_accept[self._state_id(state)])
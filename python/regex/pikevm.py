@@ -0,0 +1,207 @@
+# pikevm.py
+# Simulates an NFA directly instead of determinizing it
+#
+# Every step keeps the set of NFA states the input could be in, so matching is
+# O(n*m) for an input of length n and an NFA of m states and transitions, and
+# there is no exponential compile step. It is slower than a DFATable per
+# character but is used when the DFA would be too big to build.
+
+from charclass import alphabet_for, anchors, backwards, suffix
+
+class PikeVM(object):
+    """ Runs an NFA over the input with a set of active state ids
+
+        The NFA states are numbered 0..m-1. For every state the targets of
+        its labelled transitions on each character class and of its null
+        transitions are kept as integer tuples. A step follows the labelled
+        transitions of the active states and then adds the null closure of
+        their targets, marking each state with the step number when it is
+        reached (a sparse set that never has to be cleared), so every state
+        is visited at most once per character.
+
+        Only the states that have a labelled transition or accept are kept
+        in the active list; the others are passed through while computing
+        the closure.
+
+        It has the same find_end/match interface as a DFATable.
+    """
+    engine = "pikevm"
+
+    def __init__(self, nfa, unanchored=False):
+        states = nfa.get_states()
+        ids = dict((s, i) for i,s in enumerate(states))
+        labels = nfa.transition_values(states)
+        self.alphabet = alphabet_for(labels)
+        self.nclasses = self.alphabet.nclasses
+        self.nstates = len(states)
+
+        # states that can't reach an accept state are never added
+        live = nfa.live_states()
+        def targets(nxt):
+            return tuple(ids[u] for u in nxt if u in live)
+
+        # moves[s] maps a class id to the states s goes to on it, nulls[s]
+        # are the targets of its null transitions and asserts[s] the
+        # (anchor, target) pairs of its ^ and $ transitions
+        self.moves = []
+        self.nulls = []
+        self.asserts = []
+        self.accept = bytearray(len(states))
+        self.keep = bytearray(len(states))
+        for s in states:
+            moves = {}
+            asserts = []
+            for trans, nxt in nfa.labelled_transitions(s):
+                if nxt not in live:
+                    continue
+                if trans in anchors:
+                    asserts.append((trans, ids[nxt]))
+                    continue
+                for cid in self.alphabet.label_classes(trans):
+                    moves.setdefault(cid, []).append(ids[nxt])
+            self.moves.append(dict((cid, tuple(t)) for cid,t in moves.items()))
+            self.nulls.append(targets(nfa.null_targets(s)))
+            self.asserts.append(tuple(asserts))
+            self.accept[ids[s]] = nfa.accepts(s)
+            self.keep[ids[s]] = bool(moves or asserts or nfa.accepts(s))
+
+        start = nfa.get_start_state()
+        self.roots = (ids[start],) if start in live else ()
+        mark = [-1] * self.nstates
+        self.start = []
+        self._closure(self.roots, mark, 0, ("^",), self.start)
+        self.inner_start = []
+        self._closure(self.roots, mark, 1, (), self.inner_start)
+        self.restart = self.roots if unanchored else ()
+
+    def _closure(self, roots, mark, step, assertions, out):
+        # appends to out the kept states of the null closure of roots that
+        # aren't marked with step yet, following the transitions of the
+        # anchors in assertions too; returns true if one of them accepts
+        nulls = self.nulls
+        keep = self.keep
+        accept = self.accept
+        found = False
+        stack = list(roots)
+        while stack:
+            v = stack.pop()
+            if mark[v] == step:
+                continue
+            mark[v] = step
+            if keep[v]:
+                out.append(v)
+                if accept[v]:
+                    found = True
+            stack.extend(nulls[v])
+            if assertions:
+                for a, t in self.asserts[v]:
+                    if a in assertions:
+                        stack.append(t)
+        return found
+
+    def _step(self, curr, cid, mark, step):
+        # returns the active states after one character of class cid, and
+        # whether one of them accepts
+        moves = self.moves
+        roots = []
+        for s in curr:
+            roots.extend(moves[s].get(cid, ()))
+        nxt = []
+        found = self._closure(roots, mark, step, (), nxt)
+        if self.restart and self._closure(self.restart, mark, step, (), nxt):
+            found = True
+        return nxt, found
+
+    def _eoi_accept(self, curr):
+        # true if the active states accept at the end of the input, through
+        # the $ transitions
+        return self._closure(curr, [-1] * self.nstates, 0, ("$",), [])
+
+    def find_end(self, inp, pos=0, longest=False):
+        """ Returns the index in inp where the first (or with longest, the
+            longest) accepted prefix of inp[pos:] ends, or -1 if there is
+            none; see DFATable.find_end
+        """
+        accept = self.accept
+        rest = suffix(inp, pos)
+        classmap = self.alphabet.classmap_for(rest)
+        mark = [-1] * self.nstates
+
+        curr = self.start if pos == 0 else self.inner_start
+        last = -1
+        if any(accept[s] for s in curr):
+            if not longest:
+                return pos
+            last = pos
+        i = pos
+        for c in rest:
+            curr, found = self._step(curr, classmap[c], mark, i)
+            i += 1
+            if found:
+                if not longest:
+                    return i
+                last = i
+            elif not curr:
+                return last
+        return i if self._eoi_accept(curr) else last
+
+    def match(self, inp, pos=0):
+        """ Returns true if a prefix of inp[pos:] is accepted """
+        return self.find_end(inp, pos) != -1
+
+    def find_starts(self, inp):
+        """ Returns the indexes i where the walk over inp[i:] backwards is
+            accepted; see DFATable.find_starts
+        """
+        accept = self.accept
+        classmap = self.alphabet.classmap_for(inp)
+        mark = [-1] * self.nstates
+
+        curr = self.start
+        found = any(accept[s] for s in curr)
+        starts = []
+        i = len(inp)
+        for c in backwards(inp):
+            if found:
+                starts.append(i)
+            elif not curr:
+                break
+            curr, found = self._step(curr, classmap[c], mark, i)
+            i -= 1
+        else:
+            if found or self._eoi_accept(curr):
+                starts.append(0)
+        starts.reverse()
+        return starts
+
+    def stream_start(self):
+        """ Returns the state feed starts from; see DFATable.feed """
+        return self.start
+
+    def stream_start_match(self):
+        """ See DFATable.stream_start_match """
+        if any(self.accept[s] for s in self.start):
+            return self.inner_start
+        return None
+
+    def feed(self, chunk, state, offset):
+        """ Walks chunk from state, a list of active state ids; see
+            DFATable.feed
+        """
+        classmap = self.alphabet.classmap_for(chunk)
+        mark = [-1] * self.nstates
+
+        curr = state
+        ends = []
+        i = offset
+        for c in chunk:
+            curr, found = self._step(curr, classmap[c], mark, i)
+            i += 1
+            if found:
+                ends.append(i)
+                curr = self.inner_start
+        return curr, ends
+
+    def stream_eoi_accept(self, state):
+        """ Returns true if state accepts at the end of the input """
+        return self._eoi_accept(state)
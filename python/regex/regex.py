@@ -3,7 +3,16 @@
 
 # A regex parser implementation
 
-from automaton import NFAState, NFA, DFA
+from collections import OrderedDict, namedtuple
+import time
+
+from automaton import NFAState, NFA, DFA, StateLimitError
+import batch
+from charclass import char_class_map, anchors, byte_input
+from dfatable import DFATable
+from lazydfa import LazyDFA, max_lazy_states
+from pikevm import PikeVM
+from stream import StreamMatcher
 
 #---- Constants ----#
 unary_ops = ["*","+","?","{"]
@@ -17,12 +26,149 @@ letters = [
 ]
 digits = [0,1,2,3,4,5,6,7,8,9]
 escape = "\\"
-anchors = ["^","$"]
-char_class_map = {
-    "\\s": "[ \t]",
-    "\\w": "[0-9a-zA-Z_]"
-}
+max_cache_size = 100 # number of compiled patterns kept by match/search
+engines = ["dfa", "lazy", "pikevm"]
+max_dfa_states = 10000 # DFA size at which compile falls back to the pikevm
+min_prefilter_length = 2 # shorter literals aren't worth looking for first
+time_calls = False # time every match/search call, not only count them
+_timer = getattr(time, "perf_counter", time.time)
+_stats_hook = None # called with (pattern, stats) when tables are built
+
+
+
+#---- Regex -> AST ----#
+class Node(object):
+    """ A node of a regex's syntax tree; the subclasses list their fields in
+        _fields
+    """
+    _fields = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+                getattr(self, f) == getattr(other, f) for f in self._fields)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__,
+                ", ".join(repr(getattr(self, f)) for f in self._fields))
+
+class Char(Node):
+    """ One token that matches a single character: a literal, an escape, a
+        character class or . (the anchors ^ and $ are Chars too)
+    """
+    _fields = ("label",)
+
+    def __init__(self, label):
+        self.label = label
+
+class Concat(Node):
+    """ The items matched one after another """
+    _fields = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+class Alt(Node):
+    """ Any one of the items """
+    _fields = ("items",)
 
+    def __init__(self, items):
+        self.items = items
+
+class Repeat(Node):
+    """ node repeated from min to max times; max is None for no limit """
+    _fields = ("node", "min", "max")
+
+    def __init__(self, node, min, max):
+        self.node = node
+        self.min = min
+        self.max = max
+
+def parse(myregex):
+    """ Parses the regex into its syntax tree
+
+        ex:
+        (a|b)*c -> Concat([Repeat(Alt([Char('a'), Char('b')]), 0, None),
+                           Char('c')])
+    """
+    tokens = regex_to_array(myregex)
+    node, i = _parse_alt(tokens, 0)
+    if i < len(tokens):
+        # a ) without a matching (
+        raise ValueError("bad regex: %s" % myregex)
+    return node
+
+def _parse_alt(tokens, i):
+    # alt := concat ('|' concat)*; returns the node and the index of the
+    # token it stopped at
+    items = []
+    while True:
+        node, i = _parse_concat(tokens, i)
+        items.append(node)
+        if i == len(tokens) or tokens[i] != "|":
+            break
+        i += 1
+    return _join(Alt, items), i
+
+def _parse_concat(tokens, i):
+    # concat := (atom quantifier*)+
+    items = []
+    while i < len(tokens) and tokens[i] not in ("|", ")"):
+        tok = tokens[i]
+        if tok == "(":
+            node, i = _parse_alt(tokens, i+1)
+            if i == len(tokens):
+                raise ValueError("bad regex: %s" % "".join(tokens))
+            items.append(node)
+        elif tok in ("*", "+", "?") or tok[0] == "{":
+            if not items:
+                raise ValueError("bad regex: %s" % "".join(tokens))
+            items[-1] = Repeat(items[-1], *_repeat_bounds(tok))
+        else:
+            items.append(Char(tok))
+        i += 1
+    if not items:
+        raise ValueError("bad regex: %s" % "".join(tokens))
+    return _join(Concat, items), i
+
+def _join(cls, items):
+    # a cls node of the items, with the items of nested cls nodes (from
+    # groups, e.g. (ab)c) lifted into it
+    if len(items) == 1:
+        return items[0]
+    flat = []
+    for item in items:
+        flat.extend(item.items if type(item) is cls else [item])
+    return cls(flat)
+
+def _repeat_bounds(tok):
+    # (min, max) of a quantifier token
+    if tok == "*":
+        return 0, None
+    if tok == "+":
+        return 1, None
+    if tok == "?":
+        return 0, 1
+    try:
+        m, n = [int(x) for x in tok[1:-1].split(",")]
+    except ValueError:
+        raise ValueError("bad quantifier: %s" % tok)
+    return m, n
+
+def postfix_to_ast(post_regex):
+    """ Builds the syntax tree of a postfix regex (see postfix) """
+    stack = []
+    for c in regex_to_array(post_regex):
+        if c in binary_ops:
+            e2, e1 = stack.pop(), stack.pop()
+            stack.append(_join(Concat if c == "&" else Alt, [e1, e2]))
+        elif c in ("*", "+", "?") or c[0] == "{":
+            stack.append(Repeat(stack.pop(), *_repeat_bounds(c)))
+        else:
+            stack.append(Char(c))
+    return stack.pop()
 
 
 #---- Regex -> Postfix ----#
@@ -30,11 +176,12 @@ def postfix(myregex):
     """ Converts infix notation regex to postfix notation regex
         
         Parenthesis are removed, but the & operator is introduced for
-        concatentation
+        concatentation, so a literal & is written escaped (\&)
 
         ex:
         ((a|b)*aba*)*(a|b)(a|b) -> ab|*a&b&a*&*ab|&ab|&
         (a|b)+@vic\.(ca|com) -> ab|+@&uU|&v&i&c&\.&ca&co&m&|&
+        a&b -> a\&b&&
     """
     regex_arr = regex_to_array(myregex)
     return postfix_recur(regex_arr)[0]
@@ -53,7 +200,9 @@ def postfix_recur(arr,start=0,in_brackets=False):
     while i < len(arr):
         tok = arr[i]
         # do different things depending on the type of token
-        if tok[0] in binary_ops:
+        if tok == "&": # a literal &, not the concatenation operator
+            stack.append(escape + tok)
+        elif tok[0] in binary_ops:
             if len(stack) == 0:
                 raise ValueError("bad regex: %s" % "".join(arr))
             e1 = stack_to_postfix()
@@ -82,105 +231,234 @@ def postfix_recur(arr,start=0,in_brackets=False):
     return stack_to_postfix(), i
 
 
-#---- Postfix -> NFA ----#
+#---- AST -> NFA ----#
+def ast_to_nfa(node):
+    """ Builds the NFA of a syntax tree """
+    return _fragment(node).to_nfa()
+
+def _fragment(node):
+    if isinstance(node, Char):
+        return build_singleton_nfa(node.label)
+    if isinstance(node, Concat):
+        frag = _fragment(node.items[0])
+        for item in node.items[1:]:
+            frag = build_concat_nfa(frag, _fragment(item))
+        return frag
+    if isinstance(node, Alt):
+        return build_or_nfa([_fragment(item) for item in node.items])
+    if isinstance(node, Repeat):
+        frag = _fragment(node.node)
+        if (node.min, node.max) == (0, None):
+            return build_star_nfa(frag)
+        if (node.min, node.max) == (1, None):
+            return build_plus_nfa(frag)
+        if (node.min, node.max) == (0, 1):
+            return build_question_nfa(frag)
+        if node.max is None:
+            raise ValueError("bad quantifier: {%d,}" % node.min)
+        return build_quantifier_nfa(frag, node.min, node.max)
+    raise TypeError("not a regex syntax tree: %r" % (node,))
+
 def postfix_to_nfa(post_regex):
-    regex_arr = regex_to_array(post_regex)
-    stack = []
-    for c in regex_arr:
-        if c[0] in binary_ops:
-            e2 = stack.pop()
-            e1 = stack.pop()
-            if c == '&':
-                stack.append(build_concat_nfa(e1,e2))
-            elif c == '|':
-                stack.append(build_or_nfa(e1,e2))
-
-        elif c[0] in unary_ops:
-            e1 = stack.pop()
-            if c == '*':
-                stack.append(build_star_nfa(e1))
-            elif c == '+':
-                stack.append(build_plus_nfa(e1))
-            elif c == '?':
-                stack.append(build_question_nfa(e1))
-            elif c[0] == "{":
-                m,n = c[1:-1].split(",")
-                stack.append(build_quantifier_nfa(e1, int(m), int(n)))
-
-        else: 
-            stack.append(build_singleton_nfa(c))
+    return ast_to_nfa(postfix_to_ast(post_regex))
 
-    return stack.pop()
+class Fragment(object):
+    """ A piece of an NFA being built (Thompson's construction)
+
+        It is entered by its start state and left by its end state, which
+        has no transitions out until the fragment is joined to the next one.
+        Since the end state is kept, joining fragments never searches them
+        for their accept states: every build_* function but
+        build_quantifier_nfa takes constant time, so an NFA is built in time
+        linear in the length of the regex.
+
+        Each operator gets fresh start and end states, so a loop never runs
+        through a state that another operator also loops back to or skips
+        past.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def to_nfa(self):
+        """ Returns the NFA that accepts at the end state """
+        self.start.start = True
+        self.end.set_accept(True)
+        return NFA(self.start)
 
-# These are static constructor methods for building NFAs
+# These are static constructor methods for building NFA Fragments
 def build_singleton_nfa(transition):
     """The simplest NFA for a single character
         
-        Returns NFA
+        Returns Fragment
             V: {start, end}
             E: {(start, end, transition)}
     """
-    start = NFAState(start=True)
-    acc = NFAState(accept=True)
-    start.add_transition(acc, transition)
-    return NFA(start)
+    start = NFAState()
+    end = NFAState()
+    start.add_transition(end, transition)
+    return Fragment(start, end)
 
 #Binary Operators
-def build_concat_nfa(nfa1, nfa2):
-    """Joins two NFA together to implement the & operator"""
-    start2 = nfa2.start
-    for acc in nfa1.get_accept_states():
-        acc.add_transition(start2, None)
-        acc.set_accept(False)
-    return NFA(nfa1.get_start_state())
-
-def build_or_nfa(nfa1, nfa2):
-    """Joins two NFA together to implement the | operator"""
-    start1 = nfa1.start
-    start2 = nfa2.start
-    start1.add_transition(start2, None)
-    return NFA(nfa1.get_start_state())
+def build_concat_nfa(frag1, frag2):
+    """Joins two Fragments together to implement concatenation"""
+    frag1.end.add_transition(frag2.start, None)
+    return Fragment(frag1.start, frag2.end)
+
+def build_or_nfa(frags):
+    """Joins a list of Fragments together to implement the | operator"""
+    start = NFAState()
+    end = NFAState()
+    for frag in frags:
+        start.add_transition(frag.start, None)
+        frag.end.add_transition(end, None)
+    return Fragment(start, end)
 
 #Unary Operators
-def build_star_nfa(nfa):
-    """Returns a modified version of the nfa to implement the * operator"""
-    plus_nfa = build_plus_nfa(nfa)
-    nfa.start.accept = True    
-    return NFA(nfa.get_start_state())
-
-def build_plus_nfa(nfa):
-    """Returns a modified version of the nfa to implement the + operator"""
-    # get all accept vertices V_a
-    # for v_a in V_a: add edge from v_a to v_start
-    for acc in nfa.get_accept_states():
-        acc.add_transition(nfa.start, None)
-    return NFA(nfa.get_start_state())
-
-def build_question_nfa(nfa):
-    """Returns a modified version of the nfa to implement the ? operator"""
-    opt_state = NFAState(accept=True)
-    nfa.get_start_state().add_transition(opt_state, None)
-    return NFA(nfa.get_start_state())
-
-def build_quantifier_nfa(nfa, m, n):
-    """Returns a modified version of the nfa to implement the {m,n} operator"""
-    assert m <= n
-    curr_nfa = nfa.clone()
-    start = curr_nfa.get_start_state()
+def build_star_nfa(frag):
+    """Returns a Fragment around frag to implement the * operator"""
+    start = NFAState()
+    end = NFAState()
+    start.add_transition(frag.start, None)
+    start.add_transition(end, None)
+    frag.end.add_transition(frag.start, None)
+    frag.end.add_transition(end, None)
+    return Fragment(start, end)
+
+def build_plus_nfa(frag):
+    """Returns a Fragment around frag to implement the + operator"""
+    start = NFAState()
+    end = NFAState()
+    start.add_transition(frag.start, None)
+    frag.end.add_transition(frag.start, None)
+    frag.end.add_transition(end, None)
+    return Fragment(start, end)
+
+def build_question_nfa(frag):
+    """Returns a Fragment around frag to implement the ? operator"""
+    start = NFAState()
+    end = NFAState()
+    start.add_transition(frag.start, None)
+    start.add_transition(end, None)
+    frag.end.add_transition(end, None)
+    return Fragment(start, end)
+
+def build_quantifier_nfa(frag, m, n):
+    """Returns a Fragment made of n copies of frag to implement the {m,n}
+        operator
+
+        The copies are chained with null transitions; after the m-th one
+        every link can also skip to the end. The end state of each copy is
+        looked up in the mapping filled by clone, so building takes time
+        linear in the size of the result
+    """
+    if m > n:
+        raise ValueError("bad quantifier: {%d,%d}" % (m, n))
+    # the copies are made before frag is joined to anything, so cloning
+    # it copies only its own states
+    copies = [frag]
     for i in range(n-1):
-        new_nfa = nfa.clone()
-        for acc in curr_nfa.get_accept_states():
-            acc.add_transition(new_nfa.get_start_state(), None)
-            if i < m-1:
-                acc.set_accept(False)
-        curr_nfa = new_nfa
+        mapping = {}
+        copies.append(Fragment(frag.start.clone(mapping), mapping[frag.end]))
+    start = NFAState()
+    end = NFAState()
+    prev = start # the state the next copy is joined to
+    for i in range(n):
+        if i >= m:
+            prev.add_transition(end, None)
+        prev.add_transition(copies[i].start, None)
+        prev = copies[i].end
+    prev.add_transition(end, None)
+    return Fragment(start, end)
+
+
+#---- AST -> Literals ----#
+class _Literals(object):
+    # what is known about the strings a subexpression matches:
+    #   exact    - the only string it matches, or None
+    #   prefix   - a string every match starts with
+    #   suffix   - a string every match ends with
+    #   required - a string every match contains
+    def __init__(self, exact=None, prefix="", suffix="", required=""):
+        self.exact = exact
+        self.prefix = exact if exact is not None else prefix
+        self.suffix = exact if exact is not None else suffix
+        self.required = exact if exact is not None else required
+
+def _longest(*strs):
+    return max(strs, key=len)
+
+def _common_prefix(s1, s2):
+    i = 0
+    while i < min(len(s1), len(s2)) and s1[i] == s2[i]:
+        i += 1
+    return s1[:i]
 
-    end = NFAState(start=False, accept=True)
-    for acc in curr_nfa.get_accept_states():
-        acc.set_accept(False)
-        acc.add_transition(end, None)
+def _common_suffix(s1, s2):
+    return _common_prefix(s1[::-1], s2[::-1])[::-1]
 
-    return NFA(start)
+def literals(post_regex):
+    """ Returns (prefix, required): a literal string every match of the
+        postfix regex starts with, and the longest literal string that every
+        match is known to contain
+
+        ex:
+        www\.\w*\.(ca|com|net) -> ("www.", "www.")
+        (a|b)+@vic\.(ca|com) -> ("", "@vic.c")
+    """
+    if not post_regex:
+        return "", ""
+    return ast_literals(postfix_to_ast(post_regex))
+
+def ast_literals(node):
+    """ Returns the (prefix, required) literals of a syntax tree (see
+        literals)
+    """
+    e = _node_literals(node)
+    return e.prefix, e.required
+
+def _node_literals(node):
+    if isinstance(node, Concat):
+        e1 = _node_literals(node.items[0])
+        for item in node.items[1:]:
+            e1 = _concat_literals(e1, _node_literals(item))
+        return e1
+    if isinstance(node, Alt):
+        e1 = _node_literals(node.items[0])
+        for item in node.items[1:]:
+            e1 = _alt_literals(e1, _node_literals(item))
+        return e1
+    if isinstance(node, Repeat):
+        if node.min == 0:
+            return _Literals()
+        e = _node_literals(node.node)
+        if e.exact is not None and node.min == node.max:
+            return _Literals(e.exact * node.min)
+        return _Literals(None, e.prefix, e.suffix, e.required)
+    c = node.label
+    if c in anchors:
+        # matches the empty string, at a position
+        return _Literals("")
+    if c == "." or c[0] == "[" or c in char_class_map:
+        return _Literals()
+    if c[0] == escape:
+        return _Literals(c[1:])
+    return _Literals(c)
+
+def _concat_literals(e1, e2):
+    if e1.exact is not None and e2.exact is not None:
+        return _Literals(e1.exact + e2.exact)
+    prefix = e1.exact + e2.prefix if e1.exact is not None else e1.prefix
+    suffix = e1.suffix + e2.exact if e2.exact is not None else e2.suffix
+    return _Literals(None, prefix, suffix, _longest(
+        e1.required, e2.required, e1.suffix + e2.prefix))
+
+def _alt_literals(e1, e2):
+    if e1.exact is not None and e1.exact == e2.exact:
+        return e1
+    prefix = _common_prefix(e1.prefix, e2.prefix)
+    suffix = _common_suffix(e1.suffix, e2.suffix)
+    return _Literals(None, prefix, suffix, _longest(prefix, suffix))
 
 
 #---- Utility ----#
@@ -246,102 +524,420 @@ def regex_to_array(myregex):
     """Turns regex into array"""
     return list(_tokenize(myregex))
 
-def _in_character_class(cc, c):
-    """ Returns true if character c is in character class cc """
-    def sequence_gen(seq):
-        assert len(seq) == 3
-        digits = "0123456789"
-        letters = "abcdefghijklmnopqrstuvwxyz"
-        beg,end = seq[0], seq[2]
-
-        if beg in digits and end in digits:
-            gen = digit_gen
-        elif beg.lower() in letters and end.lower() in letters:
-            gen = letter_gen
-
-        for i in gen(beg,end):
-            yield i
-
-    def digit_gen(start,end):
-        for i in xrange(int(start),int(end)+1):
-            yield str(i)
-
-    def letter_gen(start,end):
-        letter_range = ord(end)-ord(start)
-        for i in range(0,letter_range+1):
-            yield chr(ord(start)+i)
-
-    assert cc[0] == "[" and cc[-1] == "]"
-    # strip [ and ]
-    cc = cc[1:-1]
-
-    negate = False
-    if cc[0] == "^":
-        negate = True
-        cc = cc[1:]
-
-    inclass = False
-    i = 0
-    while i < len(cc):
-        sym = cc[i]
-        if sym == "-":
-            seq = "%s%s%s" % (cc[i-1],cc[i],cc[i+1])
-            if c in list(sequence_gen(seq)):
-                inclass = True
-                break
-        elif sym == c:
-            inclass = True
-            break
-        i += 1
-
-    inclass = not(inclass) if negate else inclass
-    return inclass
-
-def _get_transition(state, c):
-    """ returns a transition of the given state that matches character c """
-    trans_values = state.get_transition_values()
-    for tv in trans_values:
-        if tv == ".":
-            return tv
-        if tv.startswith("["):
-            if _in_character_class(tv,c):
-                return tv
-        if tv.startswith("\\"):
-            cc = char_class_map.get(tv)
-            if cc and _in_character_class(cc,c):
-                return tv
-        if tv == c:
-            return tv
-
-    return None
-
-def _walk_dfa(dfa, inp):
-    """ Tranverses dfa with the given input
-        
-        returns True if traversal ended on an accept state
+#---- Compiled Patterns ----#
+class Pattern(object):
+    """ A compiled regex
+
+        The regex -> syntax tree -> NFA -> DFA pipeline is run once when the
+        Pattern is created; the DFA is then compiled to a DFATable that match
+        and search walk one table lookup per character
+
+        search uses a second, unanchored table that is built the first time
+        it is needed; the NFA is kept for it as a CompactNFA. finditer uses a
+        third one, built from the reversed NFA, to find where the matches
+        start in one backward pass over the input
+
+        engine selects how the tables are built:
+            dfa    - the whole DFA is built when the Pattern is created
+            lazy   - DFA states are built as the input reaches them and are
+                     kept in a bounded cache (see lazydfa.LazyDFA)
+            pikevm - the NFA is simulated directly (see pikevm.PikeVM); it
+                     has no compile step that can blow up, but each
+                     character costs time proportional to the NFA size
+            None   - (the default) dfa, unless the DFA has more than
+                     max_dfa_states states, then pikevm
+
+        max_states caps the number of DFA states: the size of the cache of a
+        lazy table (lazydfa.max_lazy_states by default), or with engine None
+        the DFA size at which it falls back to the pikevm (max_dfa_states by
+        default). The dfa and pikevm engines ignore it.
+
+        Pattern.engine is the engine the match table was built with. The
+        search table is built the same way, but on its own it can still fall
+        back to the pikevm when the engine was chosen automatically.
+
+        When minimize is True (the default) equivalent states of dfa tables
+        are merged; the minimize_report gives the number of states before and
+        after
+
+        A bytes regex (on Python 3) is compiled for bytes input: every byte
+        of it stands for the character with the same value. Patterns of
+        either type match bytes, bytearray, memoryview and mmap input by the
+        byte values, without decoding it or copying it.
+
+        prefilter is used by search to skip ahead with str.find:
+            ("prefix", s)   - every match starts with s, the search table is
+                              run once from where s is first found
+            ("required", s) - every match contains s, inputs without it are
+                              rejected without running the tables
+            None            - the pattern has no literal of at least
+                              min_prefilter_length characters to look for
+
+        stats records what compiling and using the pattern cost:
+            parse, nfa, dfa, table, minimize
+                             - seconds spent in each compile phase; the
+                               phases of the search table start with search_
+                               and those of the reverse table with reverse_
+            nfa_states, nfa_transitions, dfa_states, dfa_transitions,
+            state_lookups, closures, table_states
+                             - the size of the automata and the work done
+                               building the DFA (see DFA.counters)
+            cache_hits       - times the pattern cache returned the pattern
+            match_calls, match_time, search_calls, search_time,
+            findall_calls, findall_time, match_many_calls, match_many_time,
+            search_many_calls, search_many_time
+                             - calls and total seconds of each method; the
+                               seconds are only added up while time_calls is
+                               true or a stats hook is set, since timing
+                               costs more than a short match
+        The hook set with set_stats_hook receives them whenever a table is
+        built.
     """
-    tokens = list(_tokenize(inp))
-    curr_state = dfa.get_start_state()
-
-    for tv in curr_state.get_transition_values():
-        if tv == "^":
-            curr_state = curr_state.get_transition("^")
-
-    for tok in _tokenize(inp):
-        trans = _get_transition(curr_state,tok)
-        if not trans:
-            return False
-        curr_state = curr_state.get_transition(trans)
-        if curr_state.is_accept():
-            return True
-    
-    for tv in curr_state.get_transition_values():
-        if tv == "$":
-            curr_state = curr_state.get_transition("$")
-
-    return curr_state.is_accept()
+    def __init__(self, myregex, minimize=True, engine=None, max_states=None):
+        if engine is not None and engine not in engines:
+            raise ValueError("unknown engine: %s" % engine)
+        self.pattern = myregex
+        self.minimize = minimize
+        self._engine = engine
+        self.max_states = max_states
+        self.stats = _new_stats()
+        is_bytes = isinstance(myregex, bytes) and bytes is not str
+        if is_bytes:
+            myregex = myregex.decode("latin-1")
+        tree = self._timed("parse", parse, myregex)
+        nfa = self._timed("nfa", ast_to_nfa, tree)
+        self.nfa = self._timed("nfa", nfa.compact)
+        self.stats["nfa_states"] = len(self.nfa)
+        self.stats["nfa_transitions"] = len(self.nfa.edge_targets) + \
+                len(self.nfa.null_edge_targets)
+        self.table = self._build_table(unanchored=False)
+
+        prefix, required = ast_literals(tree)
+        if len(prefix) >= min_prefilter_length:
+            self.prefilter = ("prefix", prefix)
+        elif len(required) >= min_prefilter_length:
+            self.prefilter = ("required", required)
+        else:
+            self.prefilter = None
+        if self.prefilter and is_bytes:
+            kind, literal = self.prefilter
+            self.prefilter = (kind, literal.encode("latin-1"))
+        self._set_literals()
+        self.engine = self.table.engine
+        self._search_table = None
+        self._reverse_table = None
+        _report(self)
+
+    def _timed(self, phase, func, *args):
+        # calls func and adds the time it took to the phase in stats
+        start = _timer()
+        try:
+            return func(*args)
+        finally:
+            self.stats[phase] = self.stats.get(phase, 0) + _timer() - start
+
+    def _set_literals(self):
+        # the prefilter literal as text and as bytes, to find it in either
+        # kind of input; None when it can't be looked for
+        literal = self.prefilter[1] if self.prefilter else None
+        self._text_literal = self._byte_literal = literal
+        if literal is None or bytes is str:
+            return
+        if isinstance(literal, bytes):
+            self._text_literal = literal.decode("latin-1")
+        else:
+            try:
+                self._byte_literal = literal.encode("latin-1")
+            except UnicodeEncodeError:
+                # no byte is the character, but the input is searched anyway
+                self._byte_literal = None
+
+    def _literal(self, inp):
+        # the prefilter literal to look for with inp.find, or None
+        if not hasattr(inp, "find"):
+            return None
+        return self._byte_literal if byte_input(inp) else self._text_literal
+
+    @classmethod
+    def from_tables(cls, myregex, table, search_table, prefilter=None,
+            reverse_table=None):
+        """ Makes a Pattern from tables that were built before, e.g. by
+            serialize.load, without compiling myregex again; its nfa is None
+
+            Without a reverse_table finditer tries every index of the input
+            in turn, which is quadratic
+        """
+        pattern = cls.__new__(cls)
+        pattern.pattern = myregex
+        pattern.minimize = False
+        pattern._engine = table.engine
+        pattern.max_states = None
+        pattern.nfa = None
+        pattern.stats = _new_stats()
+        pattern.table = table
+        pattern.prefilter = prefilter
+        pattern._set_literals()
+        pattern.engine = table.engine
+        pattern._search_table = search_table
+        pattern._reverse_table = reverse_table
+        return pattern
+
+    def _build_table(self, unanchored, reverse=False):
+        prefix = "search_" if unanchored else ""
+        nfa = self.nfa
+        if reverse:
+            prefix = "reverse_"
+            nfa = self._timed(prefix + "nfa", nfa.reverse)
+            nfa = self._timed(prefix + "nfa", nfa.compact)
+        if self._engine == "lazy":
+            max_states = self.max_states
+            if max_states is None:
+                max_states = max_lazy_states
+            table = self._timed(prefix + "table", LazyDFA, nfa, unanchored,
+                    max_states)
+        elif self._engine == "pikevm":
+            table = self._timed(prefix + "table", PikeVM, nfa, unanchored)
+        else:
+            max_states = None
+            if self._engine is None:
+                max_states = self.max_states
+                if max_states is None:
+                    max_states = max_dfa_states
+            try:
+                dfa = self._timed(prefix + "dfa", nfa.to_dfa, unanchored,
+                        max_states)
+            except StateLimitError:
+                dfa = None
+            if dfa is None:
+                table = self._timed(prefix + "table", PikeVM, nfa, unanchored)
+            else:
+                for name, count in dfa.counters.items():
+                    self.stats[prefix + name] = count
+                # only needed to build the DFA; frees them before the table
+                # is built and minimized
+                dfa.drop_substates()
+                table = self._timed(prefix + "table", DFATable.from_dfa, dfa)
+                if self.minimize:
+                    table = self._timed(prefix + "minimize", table.minimize)
+        self.stats[prefix + "table_states"] = table.nstates
+        return table
+
+    @property
+    def search_table(self):
+        """ The table of the unanchored DFA """
+        if self._search_table is None:
+            self._search_table = self._build_table(unanchored=True)
+            _report(self)
+        return self._search_table
+
+    @property
+    def reverse_table(self):
+        """ The unanchored table of the reversed NFA, that finditer walks
+            backwards to find where matches start; None for a Pattern made
+            by from_tables without one
+        """
+        if self._reverse_table is None and self.nfa is not None:
+            self._reverse_table = self._build_table(unanchored=True,
+                    reverse=True)
+            _report(self)
+        return self._reverse_table
+
+    @property
+    def minimize_report(self):
+        """ The (before, after) state counts of the match table, or None if
+            it isn't a dfa table
+        """
+        if self.table.engine != "dfa":
+            return None
+        return (self.table.original_nstates, self.table.nstates)
+
+    def _timed_call(self, op, func, arg):
+        # returns func(arg), recording the call and its time as one of op;
+        # the methods below only count their calls unless the time is wanted
+        stats = self.stats
+        stats[op + "_calls"] += 1
+        start = _timer()
+        try:
+            return func(arg)
+        finally:
+            stats[op + "_time"] += _timer() - start
+
+    def match(self, inp):
+        """ Returns true if the beginning of the input matches the pattern """
+        if time_calls or _stats_hook is not None:
+            return self._timed_call("match", self.table.match, inp)
+        self.stats["match_calls"] += 1
+        return self.table.match(inp)
+
+    def search(self, inp):
+        """ Returns true if any substring of the input matches the pattern
+
+            The input is scanned once, left to right
+        """
+        if time_calls or _stats_hook is not None:
+            return self._timed_call("search", self._search, inp)
+        self.stats["search_calls"] += 1
+        return self._search(inp)
+
+    def match_many(self, inputs):
+        """ Returns a mask of the inputs whose beginning matches the pattern
+
+            inputs is a sequence of strings or bytes, or a NumPy array of
+            them; see batch.match_many. Walking them all in one call is much
+            faster than calling match for each.
+        """
+        if time_calls or _stats_hook is not None:
+            return self._timed_call("match_many", self._match_many, inputs)
+        self.stats["match_many_calls"] += 1
+        return self._match_many(inputs)
+
+    def search_many(self, inputs):
+        """ Returns a mask of the inputs that have a substring matching the
+            pattern; see match_many. Like search, it uses the prefilter to
+            skip the inputs without its literal; see batch.search_many.
+        """
+        if time_calls or _stats_hook is not None:
+            return self._timed_call("search_many", self._search_many, inputs)
+        self.stats["search_many_calls"] += 1
+        return self._search_many(inputs)
+
+    def _search(self, inp):
+        return self.search_end(inp) != -1
+
+    def _match_many(self, inputs):
+        return batch.match_many(self.table, inputs)
+
+    def _search_many(self, inputs):
+        literal_for = self._literal if self.prefilter else None
+        return batch.search_many(self.search_table, inputs, literal_for,
+                literal_for is not None and self.prefilter[0] == "prefix")
+
+    def search_end(self, inp, pos=0):
+        """ Returns the index where the earliest ending match in inp[pos:]
+            ends, or -1 if the pattern doesn't match
+        """
+        literal = self._literal(inp)
+        if literal is not None:
+            i = inp.find(literal, pos)
+            if i == -1:
+                return -1
+            if self.prefilter[0] == "prefix":
+                # no match starts before the first occurrence of the prefix
+                pos = i
+        return self.search_table.find_end(inp, pos)
+
+    def finditer(self, inp):
+        """ Yields the (start, end) span of every match in the input
+
+            Matches don't overlap and are leftmost-longest: of the matches
+            that start first the longest one is taken, then the search goes
+            on from its end
+
+            The indexes where a match starts are found in one backward pass
+            of the reverse table over the input; only the end of each match
+            is then looked for with the match table
+        """
+        if self.search_end(inp) == -1:
+            return
+        if self.reverse_table is None:
+            starts = range(len(inp) + 1)
+        else:
+            starts = self.reverse_table.find_starts(inp)
+        pos = 0
+        for start in starts:
+            if start < pos:
+                continue
+            end = self.table.find_end(inp, start, longest=True)
+            if end == -1:
+                continue
+            yield (start, end)
+            pos = end if end > start else end+1
+
+    def findall(self, inp):
+        """ Returns a list of the substrings matched by finditer """
+        if time_calls or _stats_hook is not None:
+            return self._timed_call("findall", self._findall, inp)
+        self.stats["findall_calls"] += 1
+        return self._findall(inp)
+
+    def _findall(self, inp):
+        return [inp[i:j] for i,j in self.finditer(inp)]
+
+    def stream(self):
+        """ Returns a StreamMatcher that searches input fed in chunks """
+        return StreamMatcher(self)
+
+    def __repr__(self):
+        return "Pattern(%r)" % self.pattern
+
+def _new_stats():
+    stats = {"cache_hits": 0}
+    for op in ("match", "search", "findall", "match_many", "search_many"):
+        stats[op + "_calls"] = 0
+        stats[op + "_time"] = 0.0
+    return stats
+
+def _report(pattern):
+    # passes the stats of pattern to the hook, if one is set
+    if _stats_hook is not None:
+        _stats_hook(pattern, pattern.stats)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class PatternCache(object):
+    """ A bounded least-recently-used cache of compiled Patterns
+
+        Keeps hit/miss counters so the effectiveness of the cache can be
+        checked with info()
+    """
+    def __init__(self, maxsize=max_cache_size):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._patterns = OrderedDict()
+
+    def get(self, myregex):
+        """ Returns the compiled Pattern for myregex, compiling on a miss """
+        # a str and a bytes regex compile to different Patterns
+        key = (type(myregex), myregex)
+        try:
+            pattern = self._patterns.pop(key)
+            self.hits += 1
+            pattern.stats["cache_hits"] += 1
+        except KeyError:
+            pattern = Pattern(myregex)
+            self.misses += 1
+            if self.maxsize <= 0:
+                return pattern
+            while len(self._patterns) >= self.maxsize:
+                self._patterns.popitem(last=False)
+        # (re)insert as the most recently used entry
+        self._patterns[key] = pattern
+        return pattern
+
+    def clear(self):
+        """ Removes all patterns and resets the counters """
+        self._patterns.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                len(self._patterns))
+
+    def __len__(self):
+        return len(self._patterns)
+
+_cache = PatternCache()
 
 #---- Public Interface ----#
+def compile(myregex, minimize=True, engine=None, max_states=None):
+    """ Compiles the regex into a Pattern that can be matched many times
+
+        see Pattern for the minimize, engine and max_states arguments
+    """
+    return Pattern(myregex, minimize, engine, max_states)
+
 def match(myregex, inp):
     """ Returns true if the input matches the given regex 
         
@@ -349,29 +945,44 @@ def match(myregex, inp):
         soon as a match is found; the match does not neccesarily contain the
         entire input
     """
-    # Convert to postfix for easier parsing
-    post_regex = postfix(myregex)
-
-    # Turn to NFA
-    nfa = postfix_to_nfa(post_regex)
-
-    # Turn to DFA
-    dfa = nfa.to_dfa()
-
-    # Walk DFA
-    return _walk_dfa(dfa,inp)
+    return _cache.get(myregex).match(inp)
 
 def search(myregex, inp):
     """ Returns true if the input matches the given regex 
         
         The match could be any substring within the input
     """
-    post_regex = postfix(myregex)
-    nfa = postfix_to_nfa(post_regex)
-    dfa = nfa.to_dfa()
-
-    while inp:
-        if _walk_dfa(dfa,inp):
-            return True
-        inp = inp[1:]
-    return False
+    return _cache.get(myregex).search(inp)
+
+def finditer(myregex, inp):
+    """ Yields the (start, end) span of each leftmost-longest match """
+    return _cache.get(myregex).finditer(inp)
+
+def findall(myregex, inp):
+    """ Returns a list of the substrings of each leftmost-longest match """
+    return _cache.get(myregex).findall(inp)
+
+def set_stats_hook(hook):
+    """ Sets the function that is called with (pattern, stats) every time
+        the tables of a Pattern are built, e.g. to send pattern.stats to a
+        metrics system; None removes it
+
+        While a hook is set every match/search call is timed, as with
+        time_calls
+    """
+    global _stats_hook
+    _stats_hook = hook
+
+def cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the pattern cache """
+    return _cache.info()
+
+def purge():
+    """ Clears the pattern cache used by match and search """
+    _cache.clear()
+
+if __name__ == "__main__":
+    # python -m regex runs the grep-like command line tool
+    import sys
+    import grep
+    sys.exit(grep.main())
@@ -0,0 +1,172 @@
+# regexset.py
+# Matches many regexes against the input in a single pass
+#
+# The NFAs of all the regexes are joined under one start state and
+# determinized together; accept states remember which regexes they accept, so
+# the cost of a scan doesn't grow with the number of regexes. Sets of
+# overlapping regexes can have exponentially large DFAs, so past max_states
+# the DFA is determinized lazily instead.
+
+from automaton import NFAState, NFA, StateLimitError
+from lazydfa import LazyDFA
+import regex
+
+class RegexSet(object):
+    """ A set of regexes compiled into one automaton
+
+        match and search return the set of indices (into patterns) of the
+        regexes that match the input
+
+        tags[s] is the set of indices of the regexes that accept in DFA state
+        s, eoi_tags[s] those that accept in s at the end of the input.
+
+        A table whose DFA would have more than max_states states is a
+        _LazyTable instead, which builds the states the input reaches; None
+        builds the whole DFA however big it gets.
+    """
+    def __init__(self, patterns, max_states=regex.max_dfa_states):
+        self.patterns = list(patterns)
+        self.max_states = max_states
+
+        start = NFAState(start=True)
+        self._accept_index = {}
+        for i, p in enumerate(self.patterns):
+            nfa = regex.ast_to_nfa(regex.parse(p))
+            for acc in nfa.get_accept_states():
+                self._accept_index[acc] = i
+            start.add_transition(nfa.get_start_state())
+        self.nfa = NFA(start)
+
+        self._match_table = None
+        self._search_table = None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _build_table(self, unanchored):
+        nfa = self.nfa
+        try:
+            dfa = nfa.to_dfa(unanchored, self.max_states)
+        except StateLimitError:
+            return _LazyTable(nfa, unanchored, self._accept_index)
+        closures = {}
+        def accepted(substates):
+            return _tags(substates, self._accept_index)
+
+        states = list(dfa.states())
+        ids = dict((s, i+1) for i,s in enumerate(states))
+        alphabet = dfa.alphabet
+        class_ids = dict((l, cid) for cid,l in enumerate(alphabet.class_labels))
+        k = alphabet.nclasses
+
+        # state 0 is the dead state
+        trans = [0] * ((len(states)+1) * k)
+        tags = [frozenset()]
+        eoi_tags = [frozenset()]
+        for s in states:
+            sid = ids[s]
+            for label, nxt in s.adj():
+                trans[sid*k + class_ids[label]] = ids[nxt]
+            substates = s.get_substates()
+            tags.append(accepted(substates))
+            eoi_tags.append(accepted(nfa.null_closure(substates, "$", closures)))
+        return (trans, tags, eoi_tags, ids[dfa.get_start_state()], alphabet)
+
+    @property
+    def match_table(self):
+        if self._match_table is None:
+            self._match_table = self._build_table(unanchored=False)
+        return self._match_table
+
+    @property
+    def search_table(self):
+        if self._search_table is None:
+            self._search_table = self._build_table(unanchored=True)
+        return self._search_table
+
+    def _scan(self, table, inp):
+        if isinstance(table, _LazyTable):
+            return table.scan(inp, len(self.patterns))
+        trans, tags, eoi_tags, s, alphabet = table
+        classmap = alphabet.classmap_for(inp)
+        k = alphabet.nclasses
+        n = len(self.patterns)
+
+        found = set(tags[s])
+        for c in inp:
+            if len(found) == n:
+                return found
+            s = trans[s*k + classmap[c]]
+            if tags[s]:
+                found |= tags[s]
+            elif not s:
+                return found
+        found |= eoi_tags[s]
+        return found
+
+    def match(self, inp):
+        """ Returns the indices of the regexes that match the beginning of the
+            input
+        """
+        return self._scan(self.match_table, inp)
+
+    def search(self, inp):
+        """ Returns the indices of the regexes that match a substring of the
+            input
+        """
+        return self._scan(self.search_table, inp)
+
+    def __repr__(self):
+        return "RegexSet(%r)" % self.patterns
+
+class _LazyTable(LazyDFA):
+    """ A LazyDFA whose states also keep the tags and eoi_tags of a
+        RegexSet table
+    """
+    def __init__(self, nfa, unanchored, accept_index):
+        self._accept_index = accept_index
+        self.tags = []
+        self.eoi_tags = []
+        super(_LazyTable, self).__init__(nfa, unanchored)
+
+    def _flush(self):
+        del self.tags[:]
+        del self.eoi_tags[:]
+        super(_LazyTable, self)._flush()
+
+    def _add_state(self, substates):
+        sid = super(_LazyTable, self)._add_state(substates)
+        self.tags.append(_tags(substates, self._accept_index))
+        eoi = self._null_closure(substates, "$")
+        self.eoi_tags.append(_tags(eoi, self._accept_index))
+        return sid
+
+    def scan(self, inp, n):
+        """ Returns the tags reached walking inp, like RegexSet._scan; n is
+            the number of regexes, after which the walk can stop
+        """
+        trans = self.trans
+        tags = self.tags
+        classmap = self.alphabet.classmap_for(inp)
+        k = self.nclasses
+
+        s = self._state_id(self._start_substates)
+        found = set(tags[s])
+        for c in inp:
+            if len(found) == n:
+                return found
+            cid = classmap[c]
+            t = trans[s*k + cid]
+            if t < 0:
+                t = self._next_state(s, cid)
+            s = t
+            if tags[s]:
+                found |= tags[s]
+            elif not s:
+                return found
+        found |= self.eoi_tags[s]
+        return found
+
+def _tags(substates, accept_index):
+    # the indices of the regexes whose accept states are in substates
+    return frozenset(accept_index[s] for s in substates if s in accept_index)
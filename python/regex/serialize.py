@@ -0,0 +1,161 @@
+# serialize.py
+# Saves compiled Patterns to a compact binary file and loads them back
+#
+# Compiling a large pattern (postfix -> NFA -> DFA -> table) can take seconds.
+# The file keeps only what matching needs: the transitions, class boundaries
+# and accept flags of the match, search and reverse tables. load maps the
+# file and reads the arrays through memoryviews, so no State objects are built
+# and processes that load the same file share its pages.
+
+from array import array
+import mmap
+import struct
+import sys
+
+from charclass import Alphabet
+from dfatable import DFATable
+import regex
+
+magic = b"RXDF"
+version = 3
+
+# magic, version, byte order (0 little, 1 big)
+_file_header = struct.Struct("=4sHH")
+# length of the pattern, 1 if it is bytes, prefilter kind, length of the
+# prefilter literal
+_pattern_header = struct.Struct("=IIII")
+# nstates, nclasses, start, inner_start, number of class boundaries
+_table_header = struct.Struct("=IIIII")
+
+_prefilter_kinds = [None, "prefix", "required"]
+_byteorder = 0 if sys.byteorder == "little" else 1
+
+# memoryviews can only be cast to int arrays from Python 3.3 on; before that
+# the arrays are copied out of the file
+_can_cast = hasattr(memoryview, "cast")
+
+def dumps(pattern):
+    """ Returns the compiled tables of pattern as a string of bytes
+
+        Raises ValueError if a table isn't a DFATable (the lazy and pikevm
+        engines have no finished table to save)
+    """
+    tables = (pattern.table, pattern.search_table, pattern.reverse_table)
+    for table in tables:
+        if table.engine != "dfa":
+            raise ValueError("can't serialize a %s table" % table.engine)
+
+    kind, literal = pattern.prefilter or (None, "")
+    is_bytes = isinstance(pattern.pattern, bytes) and bytes is not str
+    text = _encode(pattern.pattern)
+    literal = _encode(literal)
+    parts = [_file_header.pack(magic, version, _byteorder),
+            _pattern_header.pack(len(text), is_bytes,
+                _prefilter_kinds.index(kind), len(literal)),
+            _pad(text + literal)]
+    for table in tables:
+        classmap = table.alphabet.classmap
+        parts.append(_table_header.pack(table.nstates, table.nclasses,
+            table.start, table.inner_start, len(classmap.bounds)))
+        parts.append(_array_bytes(table.trans))
+        parts.append(_array_bytes(classmap.bounds))
+        parts.append(_array_bytes(classmap.ids))
+        parts.append(_pad(bytes(table.accept) + bytes(table.eoi_accept)))
+    return b"".join(parts)
+
+def dump(pattern, path):
+    """ Saves the compiled tables of pattern to the file at path """
+    with open(path, "wb") as f:
+        f.write(dumps(pattern))
+
+def loads(data):
+    """ Returns the Pattern saved in data by dumps
+
+        data can be a string of bytes or an mmap; on Python 3 the tables
+        point into it rather than copying it
+    """
+    buf = memoryview(data) if _can_cast else data
+    tag, ver, order = _file_header.unpack_from(data, 0)
+    if tag != magic:
+        raise ValueError("not a compiled pattern")
+    if ver != version:
+        raise ValueError("unsupported compiled pattern version %d" % ver)
+    swap = order != _byteorder
+
+    off = _file_header.size
+    ntext, is_bytes, kind, nliteral = _pattern_header.unpack_from(data, off)
+    off += _pattern_header.size
+    text = bytes(buf[off:off+ntext])
+    literal = bytes(buf[off+ntext:off+ntext+nliteral])
+    if not is_bytes:
+        text = _decode(text)
+        literal = _decode(literal)
+    off += _padded(ntext + nliteral)
+    kind = _prefilter_kinds[kind]
+    prefilter = (kind, literal) if kind else None
+
+    tables = []
+    for i in range(3):
+        n, k, start, inner_start, nbounds = \
+                _table_header.unpack_from(data, off)
+        off += _table_header.size
+        trans = _int_array(buf, off, n*k, swap)
+        off += 4*n*k
+        bounds = _int_array(buf, off, nbounds, swap)
+        off += 4*nbounds
+        ids = _int_array(buf, off, nbounds, swap)
+        off += 4*nbounds
+        accept = _byte_array(buf, off, n)
+        eoi_accept = _byte_array(buf, off+n, n)
+        off += _padded(2*n)
+        alphabet = Alphabet.from_classmap(bounds, ids, k)
+        tables.append(DFATable(trans, accept, eoi_accept, start, inner_start,
+            alphabet))
+    return regex.Pattern.from_tables(text, tables[0], tables[1], prefilter,
+            tables[2])
+
+def load(path):
+    """ Returns the Pattern saved to the file at path by dump
+
+        The file is memory-mapped and stays mapped while the Pattern is in
+        use
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(mm)
+
+def _padded(size):
+    # sections start at multiples of 4 bytes so the int arrays are aligned
+    return (size + 3) & ~3
+
+def _pad(data):
+    return data + b"\0" * (_padded(len(data)) - len(data))
+
+def _array_bytes(values):
+    a = array("i", values)
+    return a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+
+def _int_array(buf, off, count, swap):
+    data = buf[off:off+4*count]
+    if _can_cast and not swap:
+        return data.cast("i")
+    a = array("i")
+    if hasattr(a, "frombytes"):
+        a.frombytes(bytes(data))
+    else:
+        a.fromstring(bytes(data))
+    if swap:
+        a.byteswap()
+    return a
+
+def _byte_array(buf, off, count):
+    if _can_cast:
+        return buf[off:off+count]
+    return bytearray(buf[off:off+count])
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+def _decode(data):
+    # patterns are str: unicode on Python 3, bytes on Python 2
+    return data if isinstance(data, str) else data.decode("utf-8")
@@ -0,0 +1,98 @@
+# stream.py
+# Matching input that arrives in chunks, e.g. a large file read piece by
+# piece, without ever holding all of it in memory
+
+import mmap
+
+chunk_size = 1 << 20 # bytes scanned per feed by scan_file
+
+class StreamMatcher(object):
+    """ Searches a stream of chunks for a Pattern
+
+        The state of the unanchored DFA is kept between calls to feed, so a
+        match can start in one chunk and end in a later one. Matches are
+        reported by the position in the whole stream where they end. They
+        don't overlap: once a match ends the search starts over from the next
+        character, so each reported match is the earliest ending one after the
+        previous.
+
+        A pattern that matches the empty string (like a*) has a match ending
+        at every position: the first feed reports 0 and every character fed
+        after it ends another match. A match that needs the end of the
+        stream (like one anchored with $) is only reported by close().
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.table = pattern.search_table
+        self.state = self.table.stream_start()
+        self.offset = 0
+        self.last_end = -1
+        self.closed = False
+
+    def feed(self, chunk):
+        """ Scans the next chunk of the stream and returns a list of the
+            positions where matches end in it
+
+            chunk can be anything that yields characters, e.g. a string, or
+            a memoryview of an mmap (which yields bytes)
+        """
+        if self.closed:
+            raise ValueError("feed on a closed StreamMatcher")
+        ends = []
+        if self.offset == 0 and self.last_end < 0:
+            # an empty match at the beginning of the stream
+            restart = self.table.stream_start_match()
+            if restart is not None:
+                self.state = restart
+                ends.append(0)
+        self.state, chunk_ends = self.table.feed(chunk, self.state,
+                self.offset)
+        ends += chunk_ends
+        self.offset += len(chunk)
+        if ends:
+            self.last_end = ends[-1]
+        return ends
+
+    def close(self):
+        """ Ends the stream; returns [end] if a match ends at the end of the
+            stream (e.g. through a $ anchor), otherwise []
+        """
+        self.closed = True
+        if self.last_end != self.offset and \
+                self.table.stream_eoi_accept(self.state):
+            self.last_end = self.offset
+            return [self.offset]
+        return []
+
+def scan_file(pattern, path, size=chunk_size):
+    """ Yields the positions where matches of pattern end in the file
+
+        The file is memory-mapped and scanned through a memoryview in chunks
+        of size bytes, so no line or chunk is copied into a string. Each byte
+        is matched as the character with the same value.
+    """
+    matcher = StreamMatcher(pattern)
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped
+            for end in matcher.close():
+                yield end
+            return
+
+        try:
+            view = memoryview(mm)
+        except TypeError:
+            # Python 2's mmap can't be viewed; its slices are copied
+            view = mm
+        try:
+            for off in range(0, len(mm), size):
+                for end in matcher.feed(view[off:off+size]):
+                    yield end
+            for end in matcher.close():
+                yield end
+        finally:
+            if hasattr(view, "release"):
+                view.release()
+            mm.close()
@@ -1,6 +1,28 @@
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
 import unittest
 from automaton import State, NFAState, NFA, DFAState, DFA
+import charclass
+from charclass import CharSet, Alphabet
+from dfatable import DFATable
+import lazydfa
+from lazydfa import LazyDFA
 import regex as re
+from regexset import RegexSet
+import batch
+import bench
+import grep
+import serialize
+import stream
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
 
 class TestAutomaton(unittest.TestCase):
     def setUp(self):
@@ -85,6 +107,41 @@ class TestAutomaton(unittest.TestCase):
         self.assertTrue(p1 and p2 and p3 and p4 and p6)
         self.assertTrue(p1.is_start())
 
+    def test_null_closure(self):
+        # a long chain of null transitions ending in a cycle
+        states = [NFAState() for i in range(5000)]
+        for v, u in zip(states, states[1:]):
+            v.add_transition(u)
+        states[-1].add_transition(states[0])
+        nfa = NFA(states[0])
+
+        cache = {}
+        self.assertEquals(len(nfa.null_closure({states[0]}, cache=cache)), 5000)
+        self.assertEquals(len(cache), 1)
+        nfa.null_closure({states[0], states[1]}, cache=cache)
+        self.assertEquals(len(cache), 2)
+
+    def test_large_automaton(self):
+        # far deeper than the recursion limit
+        states = [NFAState() for i in range(50000)]
+        for v, u in zip(states, states[1:]):
+            v.add_transition(u, "a")
+        states[-1].set_accept(True)
+        states[-1].add_transition(states[0])
+        nfa = NFA(states[0])
+
+        self.assertEquals(len(nfa.get_states()), 50000)
+        self.assertEquals(len(nfa.get_accept_states()), 1)
+        self.assertFalse(any(hasattr(v, "_visited") for v in states))
+
+        mapping = {}
+        copy = nfa.clone(mapping)
+        self.assertEquals(len(mapping), 50000)
+        self.assertTrue(mapping[states[0]] is copy.get_start_state())
+        last = mapping[states[-1]]
+        self.assertTrue(last.is_accept())
+        self.assertTrue(last.get_null_transitions()[0] is copy.get_start_state())
+
     def test_DFA(self):
         s1 = NFAState()
         s2 = NFAState()
@@ -125,6 +182,124 @@ class TestAutomaton(unittest.TestCase):
         self.assertEquals(d4.get_substates(), {s5})
         self.assertEquals(d5.get_substates(), {s7})
 
+        self.assertEquals(len(dfa), 5)
+        self.assertEquals(dfa.counters["dfa_states"], 5)
+        self.assertEquals(dfa.counters["dfa_transitions"], 5)
+        self.assertTrue(dfa.get_state_by_substate({s4,s6}) is d3)
+
+    def test_CompactNFA(self):
+        nfa = self.build_nfa()
+        compact = nfa.compact()
+        self.assertEquals(len(compact), 7)
+        self.assertEquals(compact.get_states(), list(range(7)))
+        self.assertEquals(len(compact.get_accept_states()), 3)
+        self.assertEquals(len(compact.edge_targets), 5)
+        self.assertEquals(len(compact.null_edge_targets), 2)
+        self.assertTrue(compact.compact() is compact)
+
+        s1 = compact.get_start_state()
+        s2 = compact.target(s1, "a")
+        s3 = compact.null_targets(s1)[0]
+        self.assertEquals(compact.labelled_transitions(s2), [("a", s2)])
+        self.assertEquals(compact.null_closure({s1}), {s1, s3})
+        self.assertTrue(compact.accepts(s2))
+        self.assertEquals(compact.target(s1, "b"), None)
+
+        table = DFATable.from_dfa(compact.to_dfa())
+        self.assertEquals(table.nstates, 6)
+        self.assertTrue(table.match("aaa"))
+        self.assertTrue(table.match("bb"))
+        self.assertFalse(table.match("c"))
+
+        # states have no __dict__
+        self.assertFalse(hasattr(nfa.get_start_state(), "__dict__"))
+        self.assertFalse(hasattr(DFAState(), "__dict__"))
+
+    def test_drop_substates(self):
+        dfa = self.build_nfa().to_dfa()
+        d3 = dfa.get_start_state().get_transition("b")
+        substates = d3.get_substates()
+        dfa.drop_substates()
+        self.assertEquals(len(dfa), 5)
+        self.assertEquals(len(dfa.states()), 5)
+        self.assertFalse(d3.get_substates())
+        self.assertFalse(dfa.get_state_by_substate(substates))
+        self.assertTrue(DFATable.from_dfa(dfa).match("ba"))
+
+    def test_reverse(self):
+        nfa = re.ast_to_nfa(re.parse(r"^a(bc|bd)*$"))
+        rev = nfa.compact().reverse()
+        table = DFATable.from_dfa(rev.to_dfa())
+        self.assertTrue(table.match("cbdba"))
+        self.assertFalse(table.match("abdbc"))
+        self.assertFalse(table.match("bca"))
+        # the starts of the matches of a|bcd|c, found from the end
+        rev = re.ast_to_nfa(re.parse(r"a|bcd|c")).reverse()
+        table = DFATable.from_dfa(rev.to_dfa(unanchored=True))
+        self.assertEquals(table.find_starts("abcdc"), [0, 1, 2, 4])
+        self.assertEquals(table.find_starts(""), [])
+
+    def test_DFATable(self):
+        table = DFATable.from_dfa(self.build_nfa().to_dfa())
+        # the dead state and the five states of the DFA
+        self.assertEquals(table.nstates, 6)
+        self.assertEquals(len(table.trans), table.nstates * table.nclasses)
+        self.assertTrue(table.match("aaa"))
+        self.assertTrue(table.match("xba", 1))
+        self.assertFalse(table.match("c"))
+
+class TestCharClass(unittest.TestCase):
+    def test_CharSet(self):
+        self.assertEquals(CharSet.from_label("a").ranges, [(97,97)])
+        self.assertEquals(CharSet.from_label("\\.").ranges, [(46,46)])
+        self.assertEquals(CharSet.from_label("[a-cb-dx]").ranges,
+                [(97,100),(120,120)])
+        self.assertTrue("_" in CharSet.from_label("\\w"))
+        self.assertFalse("-" in CharSet.from_label("\\w"))
+        self.assertTrue("z" in CharSet.from_label("[^abc]"))
+        self.assertFalse("b" in CharSet.from_label("[^abc]"))
+        self.assertTrue("\n" in CharSet.from_label("."))
+
+    def test_Alphabet(self):
+        alphabet = Alphabet(["a", "[a-c]", "\\w"])
+        # {a}, {b,c}, \w - [a-c] and the characters matched by no label
+        self.assertEquals(alphabet.nclasses, 4)
+        self.assertEquals(alphabet.classify("@"), 0)
+        self.assertEquals(alphabet.classify("b"), alphabet.classify("c"))
+        self.assertNotEqual(alphabet.classify("a"), alphabet.classify("b"))
+        self.assertEquals(alphabet.classify("z"), alphabet.classify("0"))
+        self.assertEquals(len(alphabet.label_classes("\\w")), 3)
+
+    def test_Alphabet_many_labels(self):
+        # every letter in its own class, plus [a-z] - the letters and the
+        # characters matched by no label
+        labels = [_unichr(o) for o in range(0x100, 0x900)] + ["[a-z]"]
+        alphabet = Alphabet(labels)
+        self.assertEquals(alphabet.nclasses, 0x800 + 2)
+        self.assertEquals(alphabet.classify("a"), alphabet.classify("z"))
+        self.assertNotEqual(alphabet.classify(_unichr(0x100)),
+                alphabet.classify(_unichr(0x101)))
+        self.assertEquals(alphabet.classify(_unichr(0x900)),
+                alphabet.classify("@"))
+        self.assertEquals(len(alphabet.label_classes("[a-z]")), 1)
+
+    def test_ClassMap_bound(self):
+        alphabet = Alphabet(["a", "."])
+        for o in range(charclass.max_classmap_size + 100):
+            alphabet.classify(_unichr(o))
+        self.assertEquals(len(alphabet.classmap), charclass.max_classmap_size)
+        self.assertEquals(alphabet.classify(_unichr(0x2000)),
+                alphabet.classify("b"))
+
+    def test_shared_alphabet(self):
+        # the tables of a pattern are built over the same labels
+        for engine in ("dfa", "lazy", "pikevm"):
+            pattern = re.compile("(ab|c)+$", engine=engine)
+            self.assertTrue(pattern.table.alphabet is
+                    pattern.search_table.alphabet)
+            self.assertTrue(pattern.table.alphabet is
+                    pattern.reverse_table.alphabet)
+
 class RegexParserTestCase(unittest.TestCase):
     def setUp(self):
         pass
@@ -154,6 +329,34 @@ class RegexParserTestCase(unittest.TestCase):
         self.assertEquals(re.postfix(t8), "abc&&def&&+&")
         self.assertEquals(re.postfix(t9), "^ab&{3,5}$&&")
 
+    def test_parse(self):
+        t1,t2,t3,t4,t5,t6,t7,t8,t9 = self.get_input_cases()
+        a, b = re.Char("a"), re.Char("b")
+        self.assertEquals(re.parse(t1), re.Concat([a, b]))
+        self.assertEquals(re.parse(t2), re.Alt([a, b]))
+        self.assertEquals(re.parse(t3),
+                re.Concat([re.Alt([a, b]), re.Repeat(a, 1, None)]))
+        self.assertEquals(re.parse(t9), re.Concat([re.Char("^"),
+            re.Repeat(re.Concat([a, b]), 3, 5), re.Char("$")]))
+        self.assertEquals(re.parse(r"a|b|\+?"), re.Alt([a, b,
+            re.Repeat(re.Char("\\+"), 0, 1)]))
+        # & is an ordinary character
+        self.assertEquals(re.parse("a&b"), re.Concat([a, re.Char("&"), b]))
+        self.assertTrue(re.match("a&b", "a&b"))
+        self.assertFalse(re.match("a&b", "ab"))
+        # and postfix escapes it to tell it from the concatenation operator
+        self.assertEquals(re.postfix("a&b"), "a\\&b&&")
+        self.assertEquals(re.literals(re.postfix("a&b")), ("a&b", "a&b"))
+        nfa = re.postfix_to_nfa(re.postfix("a&b"))
+        table = DFATable.from_dfa(nfa.to_dfa())
+        self.assertTrue(table.match("a&b"))
+        self.assertFalse(table.match("ab"))
+
+        for t in self.get_input_cases():
+            self.assertEquals(re.postfix_to_ast(re.postfix(t)), re.parse(t))
+        for bad in ["", "*a", "a|", "|a", "(a", "a)", "()", "a(|b)"]:
+            self.assertRaises(ValueError, re.parse, bad)
+
     def test_nfa(self):
         t1,t2,t3,t4,t5,t6,t7,t8,t9 = self.get_input_cases()
         nfa1 = re.postfix_to_nfa(re.postfix(t1))
@@ -163,7 +366,7 @@ class RegexParserTestCase(unittest.TestCase):
         nfa5 = re.postfix_to_nfa(re.postfix(t5))
 
         self.assertEquals(len(nfa1.get_accept_states()), 1)
-        self.assertEquals(len(nfa2.get_accept_states()), 2)
+        self.assertEquals(len(nfa2.get_accept_states()), 1)
         self.assertEquals(len(nfa3.get_accept_states()), 1)
         self.assertEquals(len(nfa4.get_accept_states()), 1)
         self.assertEquals(len(nfa5.get_accept_states()), 1)
@@ -190,8 +393,8 @@ class RegexParserTestCase(unittest.TestCase):
         self.assertFalse(re.match(t4, "abaa"))
         self.assertFalse(re.match(t4, "bbbbc"))
 
-        self.assertTrue(re.match(t5, r"baafo\+"))
-        self.assertFalse(re.match(t5, "baafo+"))
+        self.assertTrue(re.match(t5, "baafo+"))
+        self.assertFalse(re.match(t5, r"baafo\+"))
 
         self.assertTrue(re.match(t6, "xy +7"))
         self.assertTrue(re.match(t6, "02 *8"))
@@ -199,7 +402,8 @@ class RegexParserTestCase(unittest.TestCase):
         self.assertFalse(re.match(t6, "Tz +1"))
         self.assertFalse(re.match(t6, "@y +9"))
 
-        self.assertTrue(re.match(t7, r"ab@vic\.ca"))
+        self.assertTrue(re.match(t7, "ab@vic.ca"))
+        self.assertFalse(re.match(t7, "ab@vicxca"))
 
         self.assertTrue(re.match(t9, r"ababab"))
         self.assertTrue(re.match(t9, r"abababab"))
@@ -210,6 +414,91 @@ class RegexParserTestCase(unittest.TestCase):
         self.assertFalse(re.match(t9, r"abababababt"))
         self.assertFalse(re.match(t9, r"tababababab"))
 
+    def test_quantifier(self):
+        self.assertTrue(re.match(r"^a{0,2}b$", "b"))
+        self.assertTrue(re.match(r"^a{0,2}b$", "aab"))
+        self.assertFalse(re.match(r"^a{0,2}b$", "aaab"))
+        self.assertTrue(re.match(r"^(a|b){0,0}c$", "c"))
+        self.assertFalse(re.match(r"^(a|b){0,0}c$", "ac"))
+        self.assertTrue(re.match(r"^(ab|c){2,3}$", "abcab"))
+        self.assertFalse(re.match(r"^(ab|c){2,3}$", "c"))
+        self.assertRaises(ValueError, re.compile, "a{3,2}")
+
+        # the NFA grows linearly with the bounds
+        nfa = re.postfix_to_nfa(re.postfix(r"(ab|cd){1,1000}"))
+        self.assertEquals(len(nfa.get_states()), 10002)
+        self.assertTrue(re.match(r"^(ab|cd){1,1000}$", "abcd" * 500))
+        self.assertFalse(re.match(r"^(ab|cd){1,1000}$", "abcd" * 500 + "ab"))
+
+    def test_thompson(self):
+        # two states per character, two more per operator
+        nfa = re.ast_to_nfa(re.parse("ab" * 10000))
+        self.assertEquals(len(nfa.get_states()), 40000)
+        nfa = re.ast_to_nfa(re.parse("(a|b|c)*"))
+        self.assertEquals(len(nfa.get_states()), 10)
+        self.assertEquals(len(nfa.get_accept_states()), 1)
+        self.assertTrue(re.match("^" + "ab" * 10000 + "$", "ab" * 10000))
+
+        # loops that used to share states with the operators around them
+        self.assertFalse(re.match(r"^((([ab])+bb)*){2,3}$", "bba"))
+        self.assertTrue(re.match(r"^((([ab])+bb)*){2,3}$", "abbabb"))
+        self.assertFalse(re.match(r"^(a*|b)c$", "bbc"))
+        self.assertTrue(re.match(r"^(a*|b)c$", "aac"))
+        self.assertFalse(re.match(r"^(a|b*)+c$", "ba"))
+        self.assertTrue(re.match(r"^(a|b*)+c$", "babbc"))
+
+    def test_literals(self):
+        t1,t2,t3,t4,t5,t6,t7,t8,t9 = self.get_input_cases()
+        self.assertEquals(re.literals(re.postfix(t1)), ("ab", "ab"))
+        self.assertEquals(re.literals(re.postfix(t2)), ("", ""))
+        self.assertEquals(re.literals(re.postfix(t4)), ("", "cd"))
+        self.assertEquals(re.literals(re.postfix(t5)), ("", "fo+"))
+        self.assertEquals(re.literals(re.postfix(t6)), ("", ""))
+        self.assertEquals(re.literals(re.postfix(t7)), ("", "@vic.c"))
+        self.assertEquals(re.literals(re.postfix(t8)), ("abcdef", "abcdef"))
+        self.assertEquals(re.literals(re.postfix(r"x(abc|abd)+y")),
+                ("xab", "xab"))
+        self.assertEquals(re.literals(re.postfix(r"(ab){0,2}c")), ("", "c"))
+
+    def test_prefilter(self):
+        p = re.compile(r"www\.\w*\.(ca|com|net)")
+        self.assertEquals(p.prefilter, ("prefix", "www."))
+        self.assertTrue(p.search("my website is www.example.com"))
+        self.assertTrue(p.search("www.www.x.ca"))
+        self.assertFalse(p.search("my website is www.example.org"))
+        self.assertEquals(p.search_end("www.www.x.ca"), 12)
+
+        p = re.compile(r"(a|b)+@vic\.(ca|com)")
+        self.assertEquals(p.prefilter, ("required", "@vic.c"))
+        self.assertTrue(p.search("mail ab@vic.com"))
+        self.assertFalse(p.search("mail @vic.com"))
+        self.assertEquals(p.findall("a@vic.ca b@vic.x ab@vic.com"),
+                ["a@vic.ca", "ab@vic.com"])
+
+        self.assertEquals(re.compile(r"(foo|bar)").prefilter, None)
+        self.assertEquals(re.compile(r"a[0-9]+").prefilter, None)
+        self.assertFalse(re.search(r"^(ab){3,5}$", "xababab"))
+
+        # the input is scanned once, not from every occurrence of the prefix
+        p = re.compile(r"ab[a-z]*z")
+        self.assertEquals(p.prefilter, ("prefix", "ab"))
+        self.assertFalse(p.search("ab" * 20000))
+        self.assertTrue(p.search("ab" * 20000 + "z"))
+
+    def test_overlapping_labels(self):
+        self.assertTrue(re.match(r"(ab|[a-c]c)", "ab"))
+        self.assertTrue(re.match(r"(ab|[a-c]c)", "ac"))
+        self.assertTrue(re.match(r"(ab|[a-c]c)", "cc"))
+        self.assertTrue(re.match(r"(x\w|.y)z", "xaz"))
+        self.assertTrue(re.match(r"(x\w|.y)z", "xyz"))
+        self.assertTrue(re.match(r"(x\w|.y)z", "-yz"))
+        self.assertFalse(re.match(r"(x\w|.y)z", "-az"))
+
+        dfa = re.postfix_to_nfa(re.postfix(r"(a|[a-c])d")).to_dfa()
+        start = dfa.get_start_state()
+        self.assertEquals(start.get_transition_values(), {"a", "[bc]"})
+        self.assertTrue(start.get_transition("a").get_transition("d"))
+
     def test_search(self):
         t1,t2,t3,t4,t5,t6,t7,t8,t9 = self.get_input_cases()
         self.assertTrue(re.search(t4, "abcdfoobar"))
@@ -222,6 +511,522 @@ class RegexParserTestCase(unittest.TestCase):
 
         self.assertTrue(re.search(t9, "ababab"))
         self.assertFalse(re.search(t9, "ttttabababzzzz"))
+        self.assertFalse(re.search(t9, "tababab"))
+
+        self.assertTrue(re.search(r"ab$", "xxab"))
+        self.assertFalse(re.search(r"ab$", "abx"))
+        self.assertTrue(re.search(r"(a|b)*", ""))
+        self.assertTrue(re.search(r"(a*)*b", "xxab"))
+
+    def test_search_end(self):
+        p = re.compile(r"(a|b)*cd")
+        self.assertEquals(p.search_end("xxabcdcd"), 6)
+        self.assertEquals(p.search_end("xxabcdcd", 6), 8)
+        self.assertEquals(p.search_end("xxabcdc", 6), -1)
+        self.assertEquals(p.search_end("x" * 100000 + "cd"), 100002)
+
+class PatternTestCase(unittest.TestCase):
+    def setUp(self):
+        re.purge()
+
+    def test_compile(self):
+        p = re.compile(r"(a|b)*cd")
+        self.assertTrue(p.match("aabababbacd"))
+        self.assertFalse(p.match("abaa"))
+        self.assertTrue(p.search("foobarabcdfoobar"))
+        self.assertFalse(p.search("zarafce"))
+
+    def test_minimize(self):
+        # the a after x and the a after y are different NFA states
+        p = re.compile(r"(xa|ya)(xa|ya)b")
+        self.assertEquals(p.minimize_report, (9, 7))
+        self.assertEquals(re.compile(r"(xa|ya)(xa|ya)b",
+            minimize=False).minimize_report, (9, 9))
+        self.assertTrue(p.match("xayab"))
+        self.assertFalse(p.match("xab"))
+        self.assertTrue(p.search("xxayayab"))
+
+    def test_lazy(self):
+        p = re.compile(r"(a|b)*a(a|b){20,20}", engine="lazy")
+        self.assertEquals(p.engine, "lazy")
+        self.assertEquals(p.minimize_report, None)
+        self.assertTrue(p.match("b" + "a" * 21))
+        self.assertFalse(p.match("b" * 30))
+        self.assertFalse(p.match("ab" * 10))
+        self.assertTrue(p.search("cc" + "ab" * 15))
+        self.assertFalse(p.search("a" * 20))
+        self.assertRaises(ValueError, re.compile, "ab", engine="x")
+
+    def test_lazy_flush(self):
+        regex = r"(a|b)*a(a|b){4,4}c"
+        lazy = re.compile(regex, engine="lazy", max_states=5)
+        dfa = re.compile(regex)
+        for i in range(64):
+            inp = "".join("ab"[(i >> j) & 1] for j in range(6)) + "bbac"
+            self.assertEquals(lazy.search(inp), dfa.search(inp))
+        self.assertTrue(lazy.search_table.flushes > 0)
+        self.assertTrue(lazy.search_table.nstates <= 5)
+        self.assertEquals(lazy.table.max_states, 5)
+        self.assertEquals(re.compile(regex, engine="lazy").table.max_states,
+                lazydfa.max_lazy_states)
+        # with the engine chosen automatically it caps the DFA instead
+        self.assertEquals(re.compile(regex, max_states=5).engine, "pikevm")
+
+    def test_pikevm(self):
+        for regex in (r"(a|b)*cd", r"^(ab){3,5}$", r"(ab|[a-c]c)",
+                r"(a|b)+@vic\.(ca|com)", r"ab$", r"(a*)*b"):
+            dfa = re.compile(regex, engine="dfa")
+            vm = re.compile(regex, engine="pikevm")
+            self.assertEquals(vm.engine, "pikevm")
+            for inp in ("", "abcd", "xxabcd", "ababab", "abababab", "ac",
+                    "ab@vic.ca", "aa@vic.com", "xab", "aab", "b"):
+                self.assertEquals(vm.match(inp), dfa.match(inp))
+                self.assertEquals(vm.search(inp), dfa.search(inp))
+                self.assertEquals(vm.search_end(inp), dfa.search_end(inp))
+        # the null closures overlap, so each step adds every state only once
+        vm = re.compile(r"(a?){100,100}a{100,100}", engine="pikevm")
+        self.assertTrue(vm.match("a" * 100))
+        self.assertTrue(vm.match("a" * 200))
+        self.assertFalse(vm.match("a" * 99))
+        self.assertEquals(vm.search_end("b" + "a" * 150), 101)
+
+    def test_engine_fallback(self):
+        self.assertEquals(re.compile(r"(a|b)*cd").engine, "dfa")
+        p = re.compile(r"(a|b)*a(a|b){14,14}")
+        self.assertEquals(p.engine, "pikevm")
+        self.assertTrue(p.match("ba" + "b" * 14))
+        self.assertFalse(p.match("b" * 16))
+        self.assertTrue(p.search("cca" + "a" * 14))
+
+    def test_finditer(self):
+        p = re.compile(r"(a|b)*cd")
+        self.assertEquals(list(p.finditer("xxabcdcdzcd")),
+                [(2,6), (6,8), (9,11)])
+        self.assertEquals(p.findall("xxabcdcdzcd"), ["abcd", "cd", "cd"])
+        self.assertEquals(list(p.finditer("xxabc")), [])
+        # leftmost, then longest
+        self.assertEquals(re.findall(r"(abcd|c)", "abcd"), ["abcd"])
+        self.assertEquals(re.findall(r"(a|ab)(c|bcd)", "abcd"), ["abcd"])
+        self.assertEquals(list(re.finditer(r"a*", "baa")),
+                [(0,0), (1,3), (3,3)])
+        self.assertEquals(list(re.finditer(r"^ab", "abab")), [(0,2)])
+        self.assertEquals(list(re.finditer(r"ab$", "abab")), [(2,4)])
+        self.assertEquals(re.findall(r"\w+", "to be, or not"),
+                ["to", "be", "or", "not"])
+        for engine in ("lazy", "pikevm"):
+            self.assertEquals(re.compile(r"\w+@\w+", engine=engine).findall(
+                "a@b, cc@dd and e@"), ["a@b", "cc@dd"])
+        # the starts are found in one pass, not by trying each index
+        inp = "x" * 2000 + "z" + "xxy"
+        for engine in re.engines:
+            p = re.compile(r"x*y", engine=engine)
+            self.assertEquals(list(p.finditer(inp)), [(2001, 2004)])
+            self.assertEquals(p.reverse_table.engine, engine)
+            self.assertEquals(p.reverse_table.find_starts(inp),
+                    [2001, 2002, 2003])
+        p = re.compile(r"^a|b*$")
+        q = re.Pattern.from_tables(p.pattern, p.table, p.search_table)
+        self.assertTrue(q.reverse_table is None)
+        for inp in ("ab", "abb", "bab", ""):
+            self.assertEquals(list(q.finditer(inp)), list(p.finditer(inp)))
+
+    def test_dead_states(self):
+        # states that can't reach an accept state go to the dead state
+        p = re.compile(r"(a$b|c)", minimize=False)
+        self.assertEquals(len(p.nfa.to_dfa()), 3)
+        self.assertEquals(p.table.nstates, 3)
+        self.assertEquals(p.table.find_end("ab"), -1)
+        p = re.compile(r"ab(c|d)*", minimize=False)
+        self.assertEquals(p.table.find_end("abcdx" + "c" * 1000,
+            longest=True), 4)
+
+    def test_cache(self):
+        re.match(r"ab", "ab")
+        re.search(r"ab", "xab")
+        re.match(r"(a|b)", "b")
+        info = re.cache_info()
+        self.assertEquals((info.hits, info.misses, info.currsize), (1, 2, 2))
+
+    def test_cache_eviction(self):
+        cache = re.PatternCache(maxsize=2)
+        p1 = cache.get("a")
+        cache.get("b")
+        self.assertTrue(cache.get("a") is p1)
+        cache.get("c") # evicts "b", the least recently used
+        self.assertEquals(len(cache), 2)
+        self.assertTrue(cache.get("a") is p1)
+        cache.get("b")
+        self.assertEquals(cache.info().misses, 4)
+
+    def test_bytes(self):
+        data = b"see www.a.ca, www.bc.net"
+        for regex in [r"www\.\w*\.(ca|com|net)", br"www\.\w*\.(ca|com|net)"]:
+            for engine in ("dfa", "lazy", "pikevm"):
+                p = re.compile(regex, engine=engine)
+                for inp in [data, bytearray(data), memoryview(data)]:
+                    self.assertTrue(p.search(inp))
+                    self.assertFalse(p.match(inp))
+                    self.assertEquals(list(p.finditer(inp)),
+                            [(4, 12), (14, 24)])
+        p = re.compile(br"www\.\w*\.(ca|com|net)")
+        self.assertEquals(p.prefilter, ("prefix", b"www."))
+        self.assertEquals(p.findall(data), [b"www.a.ca", b"www.bc.net"])
+        self.assertTrue(p.search(data.decode("ascii")))
+        self.assertFalse(re.compile("[^a-z]+").match(b"abc"))
+        self.assertTrue(re.compile("[^a-z]+").match(b"\xff"))
+
+    def test_bytes_mmap(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b"see www.a.ca")
+            os.close(fd)
+            p = re.compile(r"www\.\w*\.(ca|com|net)")
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            mm.seek(8) # find on an mmap starts at its position by default
+            self.assertTrue(p.search(mm))
+            self.assertEquals(list(p.finditer(mm)), [(4, 12)])
+            mm.close()
+        finally:
+            os.remove(path)
+
+    def test_stats(self):
+        p = re.compile(r"(a|b)+@vic\.(ca|com)")
+        stats = p.stats
+        for phase in ("parse", "nfa", "dfa", "table",
+                "minimize"):
+            self.assertTrue(stats[phase] >= 0)
+        self.assertEquals(stats["nfa_states"], len(p.nfa.get_states()))
+        self.assertEquals(stats["table_states"], p.table.nstates)
+        self.assertTrue(stats["dfa_states"] >= stats["table_states"] - 1)
+        self.assertFalse("search_dfa" in stats)
+
+        p.search("ab@vic.ca")
+        p.search("ab@vic.com")
+        p.match("ab@vic.ca")
+        self.assertEquals(stats["search_calls"], 2)
+        self.assertEquals(stats["match_calls"], 1)
+        self.assertEquals(stats["findall_calls"], 0)
+        self.assertTrue(stats["search_dfa_states"] > 0)
+        # calls are only timed when asked to
+        self.assertEquals(stats["search_time"], 0)
+        re.time_calls = True
+        try:
+            p.search("ab@vic.ca")
+            p.findall("ab@vic.ca")
+        finally:
+            re.time_calls = False
+        self.assertEquals(stats["search_calls"], 3)
+        self.assertTrue(stats["search_time"] > 0)
+        self.assertTrue(stats["findall_time"] > 0)
+        self.assertEquals(stats["match_time"], 0)
+
+        p = re.compile("(a|b)*a(a|b){14,14}")
+        self.assertEquals(p.engine, "pikevm")
+        self.assertFalse("dfa_states" in p.stats)
+        self.assertTrue(p.stats["dfa"] > 0)
+
+    def test_stats_hook(self):
+        reports = []
+        re.set_stats_hook(lambda p, stats: reports.append((p, dict(stats))))
+        try:
+            re.purge()
+            p = re.compile("(a|b)c")
+            p.search("xbc")
+            p.search("xbc")
+            re.match("cd", "cd")
+            re.match("cd", "cd")
+        finally:
+            re.set_stats_hook(None)
+        self.assertTrue(p.stats["search_time"] > 0)
+        # the search table is built by the first search
+        self.assertEquals([r[0].pattern for r in reports],
+                ["(a|b)c", "(a|b)c", "cd"])
+        self.assertFalse("search_table" in reports[0][1])
+        self.assertTrue("search_table" in reports[1][1])
+        self.assertEquals(re._cache.get("cd").stats["cache_hits"], 2)
+
+    def test_cache_types(self):
+        re.purge()
+        self.assertTrue(re.search("a+", b"xaa"))
+        self.assertTrue(re.search(b"a+", b"xaa"))
+        # on Python 2 both are the same str
+        self.assertEquals(re.cache_info().currsize, 1 if bytes is str else 2)
+
+class StreamTestCase(unittest.TestCase):
+    def test_feed(self):
+        for engine in ("dfa", "lazy", "pikevm"):
+            m = re.compile(r"(a|b)+@vic\.(ca|com)", engine=engine).stream()
+            self.assertEquals(m.feed("xxab@v"), [])
+            self.assertEquals(m.feed("ic.ca b@vic"), [11])
+            self.assertEquals(m.feed(".com"), [21])
+            self.assertEquals(m.feed(""), [])
+            self.assertEquals(m.close(), [])
+            self.assertRaises(ValueError, m.feed, "ab@vic.ca")
+
+    def test_anchors(self):
+        m = re.compile(r"ab$").stream()
+        self.assertEquals(m.feed("abxa"), [])
+        self.assertEquals(m.feed("b"), [])
+        self.assertEquals(m.close(), [5])
+        m = re.compile(r"^ab").stream()
+        self.assertEquals(m.feed("a"), [])
+        self.assertEquals(m.feed("bab"), [2])
+
+    def test_empty_matches(self):
+        for engine in ("dfa", "lazy", "pikevm"):
+            m = re.compile(r"a*", engine=engine).stream()
+            self.assertEquals(m.feed(""), [0])
+            self.assertEquals(m.feed("xyz"), [1, 2, 3])
+            self.assertEquals(m.close(), [])
+            m = re.compile(r"^a*", engine=engine).stream()
+            self.assertEquals(m.feed("aa"), [0])
+            self.assertEquals(m.close(), [])
+            m = re.compile(r"x?$", engine=engine).stream()
+            self.assertEquals(m.feed("ab"), [])
+            self.assertEquals(m.close(), [2])
+            self.assertEquals(re.compile(r"a*", engine=engine).stream()
+                    .close(), [0])
+
+    def test_scan_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b"foo ab@vic.ca\nbar\nb@vic.com\n" * 1000)
+            os.close(fd)
+            p = re.compile(r"(a|b)+@vic\.(ca|com)")
+            ends = list(stream.scan_file(p, path, size=100))
+            self.assertEquals(len(ends), 2000)
+            self.assertEquals(ends[:3], [13, 27, 41])
+        finally:
+            os.remove(path)
+
+    def test_scan_empty_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertEquals(list(stream.scan_file(re.compile("a"), path)), [])
+            self.assertEquals(list(stream.scan_file(re.compile("^$"), path)),
+                    [0])
+        finally:
+            os.remove(path)
+
+class BatchTestCase(unittest.TestCase):
+    inputs = ["ab_12", "ab_", "_1", "", "x ab_1", "abc_9z", "ab_1$", u"\xe9_1"]
+    regexes = [r"[a-j]+_[0-9]+", r"^ab_[0-9]+$", r"[0-9]$", r"x?", r"\w*z"]
+
+    def test_match_many(self):
+        for regex in self.regexes:
+            for engine in re.engines:
+                p = re.compile(regex, engine=engine)
+                self.assertEquals(p.match_many(self.inputs),
+                        [p.match(inp) for inp in self.inputs])
+                self.assertEquals(p.search_many(self.inputs),
+                        [p.search(inp) for inp in self.inputs])
+        p = re.compile(r"[a-j]+_[0-9]+")
+        self.assertEquals(p.match_many([]), [])
+        self.assertEquals(p.match_many([b"ab_1", bytearray(b"_1")]),
+                [True, False])
+        self.assertEquals(p.match_many(iter(["ab_1"])), [True])
+        self.assertEquals(p.stats["match_many_calls"], 3)
+
+    def test_search_many_prefilter(self):
+        records = ["http://x%d.org/path/%d" % (i, i % 100) for i in range(20000)]
+        records += ["see example.com/path/42", "example.com/path/4",
+                "xexample.com/path/42", u"\xe9 example.com/path/42"]
+        for regex in (r"example\.com/path/42", r"\w+\.com/path/42"):
+            p = re.compile(regex)
+            self.assertTrue(p.prefilter is not None)
+            expected = [p.search(inp) for inp in records]
+            self.assertEquals(p.search_many(records), expected)
+            self.assertEquals(p.search_many([inp.encode("utf-8")
+                    for inp in records]), expected)
+        # the records without the literal aren't walked, so it beats a loop
+        p = re.compile(r"example\.com/path/42")
+        def best(func):
+            times = []
+            for i in range(3):
+                start = re._timer()
+                func()
+                times.append(re._timer() - start)
+            return min(times)
+        self.assertTrue(best(lambda: p.search_many(records)) <=
+                best(lambda: [p.search(inp) for inp in records]))
+
+    def test_serialized(self):
+        p = serialize.loads(serialize.dumps(re.compile(r"^ab_[0-9]+$")))
+        self.assertEquals(p.match_many(self.inputs),
+                [True, False, False, False, False, False, False, False])
+
+    @unittest.skipIf(batch.numpy is None, "NumPy isn't installed")
+    def test_numpy(self):
+        numpy = batch.numpy
+        arrays = [numpy.array(self.inputs),
+                numpy.array([s.encode("utf-8") for s in self.inputs])]
+        for regex in self.regexes:
+            for engine in re.engines:
+                p = re.compile(regex, engine=engine)
+                for arr in arrays:
+                    mask = p.match_many(arr)
+                    self.assertEquals(mask.dtype, bool)
+                    self.assertEquals(list(mask),
+                            [p.match(inp) for inp in arr.tolist()])
+                    self.assertEquals(list(p.search_many(arr)),
+                            [p.search(inp) for inp in arr.tolist()])
+        p = re.compile(r"[a-j]+_[0-9]+")
+        grid = numpy.array([["ab_1", "x"], ["", "j_0"]])
+        self.assertEquals(p.match_many(grid).tolist(),
+                [[True, False], [False, True]])
+        self.assertEquals(p.match_many(grid[:, 1]).tolist(), [False, True])
+        self.assertEquals(p.match_many(numpy.array(["ab_1", b"_1"], dtype=object))
+                .tolist(), [True, False])
+
+class SerializeTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        inputs = ["www.example.com", "see www.a.ca", "www..net", "www.a.c",
+                "", "x www.b.comwww.c.net"]
+        for regex in [r"www\.\w*\.(ca|com|net)", r"^ab|c$", r"[^a-c]+x?",
+                r"a*"]:
+            p = re.compile(regex)
+            q = serialize.loads(serialize.dumps(p))
+            self.assertEquals(q.pattern, regex)
+            self.assertEquals(q.prefilter, p.prefilter)
+            self.assertEquals(q.table.nstates, p.table.nstates)
+            for inp in inputs:
+                self.assertEquals(q.match(inp), p.match(inp))
+                self.assertEquals(q.search(inp), p.search(inp))
+                self.assertEquals(list(q.finditer(inp)),
+                        list(p.finditer(inp)))
+
+    def test_load_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            serialize.dump(re.compile(r"(a|b)+@vic\.(ca|com)"), path)
+            p = serialize.load(path)
+            self.assertTrue(p.nfa is None)
+            self.assertEquals(p.engine, "dfa")
+            self.assertTrue(p.search("mail ab@vic.ca"))
+            self.assertFalse(p.match("mail ab@vic.ca"))
+            self.assertEquals(p.findall("ab@vic.ca, b@vic.com"),
+                    ["ab@vic.ca", "b@vic.com"])
+            self.assertEquals(p.stream().feed("xxab@vic.com"), [12])
+        finally:
+            os.remove(path)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, serialize.loads, b"XXXX" + b"\0" * 64)
+        data = serialize.dumps(re.compile("a"))
+        self.assertRaises(ValueError, serialize.loads,
+                data[:4] + b"\x63\0" + data[6:])
+        self.assertRaises(ValueError, serialize.dumps,
+                re.compile("a", engine="lazy"))
+
+class GrepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "sub"))
+        for name, data in [("a.txt", b"foo ab@vic.ca\nbar\nb@vic.com\n"),
+                ("c", b"none\n"), ("sub/b.log", b"nothing\nx@vic.ca")]:
+            with open(os.path.join(self.dir, name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def grep(self, *argv):
+        out = io.BytesIO()
+        status = grep.main(list(argv), out)
+        return status, out.getvalue().decode("ascii").replace(self.dir, "D")
+
+    def test_lines(self):
+        for jobs in ("1", "2"):
+            self.assertEquals(self.grep("-j", jobs, "-n", r"\w+@vic\.(ca|com)",
+                    self.dir), (0, "D/a.txt:1:foo ab@vic.ca\nD/a.txt:3:"
+                    "b@vic.com\nD/sub/b.log:2:x@vic.ca\n"))
+        path = os.path.join(self.dir, "a.txt")
+        self.assertEquals(self.grep("com$", path), (0, "b@vic.com\n"))
+        self.assertEquals(self.grep("zzz", path), (1, ""))
+
+    def test_modes(self):
+        self.assertEquals(self.grep("-c", "-j", "2", "@vic", self.dir),
+                (0, "D/a.txt:2\nD/c:0\nD/sub/b.log:1\n"))
+        self.assertEquals(self.grep("-l", "--engine", "pikevm", "vic\.ca$",
+                self.dir), (0, "D/a.txt\nD/sub/b.log\n"))
+        missing = os.path.join(self.dir, "missing")
+        self.assertEquals(self.grep("-c", "a", missing), (2, ""))
+
+    def test_dump(self):
+        # the match table is a dfa but the search table falls back to the
+        # pikevm, so the workers compile the regex with the engine left open
+        p = re.compile(r"a(a|b){14,14}")
+        self.assertEquals(p.engine, "dfa")
+        self.assertEquals(p.search_table.engine, "pikevm")
+        self.assertEquals(grep._dump(p), ("regex", p.pattern, None))
+        p = re.compile(r"ab", engine="lazy")
+        self.assertEquals(grep._dump(p), ("regex", "ab", "lazy"))
+        self.assertEquals(grep._dump(re.compile(r"ab"))[0], "tables")
+
+class BenchTestCase(unittest.TestCase):
+    def test_run(self):
+        results = bench.run(size=2000, repeat=1, names=["literal", "counted"])
+        json.dumps(results)
+        self.assertEquals([r["name"] for r in results["results"]],
+                ["literal", "counted"])
+        result = results["results"][1]
+        self.assertEquals(result["engine"], "dfa")
+        self.assertEquals(result["compile"]["table_states"], 63)
+        self.assertEquals(len(result["matching"]), 3*len(bench.corpora))
+        for m in result["matching"]:
+            self.assertEquals(m["matches"], m["stdlib_matches"])
+
+    def test_corpora(self):
+        for name, make in bench.corpora:
+            self.assertEquals(len(make(1000)), 1000)
+            self.assertEquals(make(1000), make(1000))
+
+    def test_best_time(self):
+        # timed with the clock of Pattern.stats
+        ticks = iter([0.0, 3.0, 10.0, 12.0])
+        timer = re._timer
+        re._timer = lambda: next(ticks)
+        try:
+            self.assertEquals(bench.best_time(lambda: "x", 2), (2.0, "x"))
+        finally:
+            re._timer = timer
+
+class RegexSetTestCase(unittest.TestCase):
+    def test_search(self):
+        regexes = [r"(a|b)*cd", r"^(ab){3,5}$", r"\w+@vic\.(ca|com)", r"ab$",
+                r"(ab|[a-c]c)"]
+        rs = RegexSet(regexes)
+        self.assertEquals(len(rs), 5)
+        for inp in ("", "abcd", "xxabcd", "ababab", "abababab", "ac",
+                "ab@vic.ca", "aa@vic.com", "xab", "aab", "b", "zzz"):
+            self.assertEquals(rs.search(inp),
+                set(i for i,r in enumerate(regexes) if re.search(r, inp)))
+            self.assertEquals(rs.match(inp),
+                set(i for i,r in enumerate(regexes) if re.match(r, inp)))
+
+    def test_many(self):
+        words = ["error%d" % i for i in range(200)]
+        rs = RegexSet(words)
+        self.assertEquals(rs.search("an error17 and error170 here"),
+                {1, 17, 170})
+        self.assertEquals(rs.search("no errors"), set())
+
+    def test_lazy_fallback(self):
+        # overlapping regexes whose DFA is exponential in their number
+        regexes = [r"(a|b)*a(a|b){%d,%d}c" % (i, i) for i in range(30)]
+        self.assertEquals(RegexSet(regexes).max_states, re.max_dfa_states)
+        rs = RegexSet(regexes, max_states=200)
+        patterns = [re.compile(r, engine="pikevm") for r in regexes]
+        for inp in ("ab" * 20 + "c", "ba" * 20 + "c", "aaac", "c", ""):
+            self.assertEquals(rs.search(inp),
+                set(i for i,p in enumerate(patterns) if p.search(inp)))
+            self.assertEquals(rs.match(inp),
+                set(i for i,p in enumerate(patterns) if p.match(inp)))
+        self.assertTrue(isinstance(rs.search_table, LazyDFA))
+        self.assertTrue(isinstance(rs.match_table, LazyDFA))
 
 
 if __name__ == "__main__":
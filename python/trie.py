@@ -37,25 +37,43 @@ class Trie(object):
             node = node.children[char]
         return True
 
-    def _get_all(self):
-        results = set()
-        if self.flag:
-            results.add(self.value)
-        for letter,node in self.children.iteritems():
-            results = results.union(node.get_all())
-        return results
-
-    def autocomplete(self,prefix):
-        """ Returns a set containing all the words in the Trie 
-            with teh given prefix
+    def _words(self):
+        """ Yields the words in this subtree in lexicographic order
+
+            The subtree is walked depth first with a stack instead of
+            recursion, so each word is yielded as soon as it is reached
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.flag:
+                yield node.value
+            # the smallest child is popped first
+            for char in sorted(node.children, reverse=True):
+                stack.append(node.children[char])
+
+    def autocomplete(self, prefix, limit=None):
+        """ Yields the words in the Trie with the given prefix, in
+            lexicographic order
+
+            At most limit words are yielded; the walk stops as soon as they
+            are found, so its cost depends on the number of words returned
+            rather than on the size of the subtree
         """
         node = self
         for c in prefix:
             if c not in node.children:
-                return set()
+                return
             node = node.children[c]
 
-        return node._get_all()
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        for word in node._words():
+            yield word
+            count += 1
+            if count == limit:
+                return
 
 
 # run tests
@@ -77,3 +95,12 @@ if __name__ == "__main__":
     assert "bar" in t.autocomplete("ba") 
     assert "baz" in t.autocomplete("ba") 
     assert "bat" not in t.autocomplete("ba") 
+
+    assert list(t.autocomplete("")) == ["bar", "baz", "foo", "foobar"]
+    assert list(t.autocomplete("", limit=2)) == ["bar", "baz"]
+    assert list(t.autocomplete("foo", limit=0)) == []
+    assert list(t.autocomplete("x")) == []
+
+    # a deep subtree doesn't recurse
+    t.insert("z" * 5000)
+    assert list(t.autocomplete("zz", limit=1)) == ["z" * 5000]